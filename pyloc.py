@@ -10,9 +10,14 @@ import importlib
 import inspect
 import re
 import os
+import threading
+import time
 from textwrap import dedent
 import ast
+import contextlib
+import itertools
 from collections import namedtuple
+from collections import OrderedDict
 
 # =============== #
 # Compute version #
@@ -68,42 +73,743 @@ class AttributeNameError(PylocError):
 
 Location = namedtuple('Location', 'filename line column')
 
-class _ClassDefVisitor(ast.NodeVisitor):
+# Phases whose duration is measured when timings are requested, in the
+# order they are reported.
+PHASES = ("index", "find_spec", "import", "getsourcefile", "find_file",
+          "read", "unmarshal", "parse", "visit", "disamb", "total")
 
-    def __init__(self, qualname):
-        self.qualname = qualname
-        self.candidates = []
+try:
+    _perf_counter_ns = time.perf_counter_ns
+except AttributeError: # Python < 3.7
+    # Python 2: no monotonic clock.
+    _perf_counter = getattr(time, "perf_counter", time.time)
+    def _perf_counter_ns():
+        return int(_perf_counter() * 1e9)
+
+_TIMINGS = threading.local()
+
+# Events passed to hooks, and the counters they update in stats().
+EVENTS = ("import_start", "import_end", "read", "parse", "cache_hit",
+          "cache_miss", "disamb")
+_EVENT_COUNTERS = {
+    "import_end": ("imports", "import_ns"),
+    "read": ("reads", "read_ns"),
+    "parse": ("parses", "parse_ns"),
+    "cache_hit": ("cache_hits", None),
+    "cache_miss": ("cache_misses", None),
+    "disamb": ("disambs", "disamb_ns"),
+}
+
+# Replaced, never mutated, so that it can be iterated without lock.
+_HOOKS = ()
+_HOOKS_LOCK = threading.Lock()
+_STATS = dict((key, 0) for keys in _EVENT_COUNTERS.values() for key in keys
+              if key is not None)
+_STATS_LOCK = threading.Lock()
+
+def add_hook(hook):
+    """Call *hook(event, name, duration)* whenever an event happens.
+
+    *event* is one of EVENTS, *name* the module name for import events and
+    the file name otherwise and *duration* the nanoseconds it took (0 for
+    instant events). Hooks are called in the thread doing the lookup and
+    their exceptions are not caught.
+    """
+    global _HOOKS
+    with _HOOKS_LOCK:
+        _HOOKS = _HOOKS + (hook,)
+
+def remove_hook(hook):
+    """Stop calling *hook* registered by add_hook()."""
+    global _HOOKS
+    with _HOOKS_LOCK:
+        hooks = list(_HOOKS)
+        hooks.remove(hook)
+        _HOOKS = tuple(hooks)
+
+def stats():
+    """Return a snapshot of the cumulative event counters of the process."""
+    with _STATS_LOCK:
+        return dict(_STATS)
+
+def _emit(event, name, duration=0):
+    count_key, ns_key = _EVENT_COUNTERS.get(event, (None, None))
+    if count_key is not None:
+        with _STATS_LOCK:
+            _STATS[count_key] += 1
+            if ns_key is not None:
+                _STATS[ns_key] += duration
+    for hook in _HOOKS:
+        hook(event, name, duration)
+
+@contextlib.contextmanager
+def _timed(phase, name=None, event=None):
+    """Add the time spent in the block to *phase* in the timings of the
+    current thread's lookup, if any, and emit *event* about *name*."""
+    timings = getattr(_TIMINGS, "current", None)
+    if timings is None and event is None:
+        yield
+        return
+    start = _perf_counter_ns()
+    try:
+        yield
+    finally:
+        duration = _perf_counter_ns() - start
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0) + duration
+        if event is not None:
+            _emit(event, name, duration)
+
+def _iter_assigned_names(node):
+    assert isinstance(node, ast.Assign)
+    for target in node.targets:
+        for n in ast.walk(target):
+            # Skip names in subscript or attribute targets.
+            if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store):
+                yield n
+
+def _get_first_line(node):
+    """Return the line reported by code objects for a function definition.
+
+    That is the line of the first decorator if any.
+    """
+    return min([node.lineno] + [d.lineno for d in node.decorator_list])
+
+def _get_last_line(node):
+    end = getattr(node, "end_lineno", None)
+    if end is None: # Before Python 3.8
+        end = max(getattr(n, "lineno", 0) for n in ast.walk(node))
+    return end
+
+class _StringTable(object):
+    """Strings shared by all the symbol tables, each stored once and referred
+    to by its index.
+
+    Strings are never removed: there are only as many as distinct names in
+    the parsed modules.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._strings = []
+        self._lock = threading.Lock()
+
+    def intern(self, string):
+        """Return the index of *string*, adding it if needed."""
+        i = self._ids.get(string)
+        if i is None:
+            with self._lock:
+                i = self._ids.get(string)
+                if i is None:
+                    i = len(self._strings)
+                    self._strings.append(string)
+                    self._ids[string] = i
+        return i
+
+    def find(self, string):
+        """Return the index of *string* or -1 if it was never added."""
+        return self._ids.get(string, -1)
+
+    def __getitem__(self, i):
+        return self._strings[i]
+
+_STRINGS = _StringTable()
+
+# Kinds of binding, in the order of their code in symbol records.
+_BINDING_KINDS = ("class", "function", "assign", "import", "star", "other")
+
+# Fields of the symbol records, each stored as an integer. Strings are
+# indexes in _STRINGS (-1 if None) and parent is the record number of the
+# parent class (-1 at module level).
+_RECORD_FIELDS = ("qualname", "parent", "kind", "flags", "line", "column",
+                  "end_line", "first_line", "alias_name", "from_module",
+                  "level")
+_RECORD_SIZE = len(_RECORD_FIELDS)
+
+# Flags of the symbol records.
+_NESTED = 1 # In a compound statement, thus conditionally executed.
+_FROM_IMPORT = 2 # Bound by "from module import name".
+_HAS_ASNAME = 4 # Imported with "as name".
+
+def _record_property(field, decode=None):
+    offset = _RECORD_FIELDS.index(field)
+    def get(self):
+        value = self.table._records[self.row * _RECORD_SIZE + offset]
+        return value if decode is None else decode(value)
+    return property(get)
+
+def _decode_string(i):
+    return None if i < 0 else _STRINGS[i]
+
+class _Binding(object):
+    """View on the record *row* of the symbol *table*.
+
+    Positions are named like the attributes of AST nodes.
+    """
+
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    kind = _record_property("kind", _BINDING_KINDS.__getitem__)
+    parent = _record_property("parent", lambda i: None if i < 0 else i)
+    lineno = _record_property("line")
+    col_offset = _record_property("column")
+    end_lineno = _record_property("end_line")
+    first_line = _record_property("first_line")
+    alias_name = _record_property("alias_name", _decode_string)
+    from_module = _record_property("from_module", _decode_string)
+    level = _record_property("level")
+    nested = _record_property("flags", lambda flags: bool(flags & _NESTED))
+    is_from_import = _record_property(
+        "flags", lambda flags: bool(flags & _FROM_IMPORT))
+    has_asname = _record_property(
+        "flags", lambda flags: bool(flags & _HAS_ASNAME))
+
+class _SymbolTable(object):
+    """Table of all the names bound in a module.
+
+    The table maps every qualified name to the list of its bindings in
+    source order (see _SymbolTableVisitor). Bindings are stored as
+    records of integers in a single array, so that no AST node is kept
+    alive: a record costs a few dozens of bytes whereas the AST of a
+    module costs hundreds of bytes per node. Records are looked up by
+    bisection of their qualified names sorted by index in _STRINGS.
+    """
+
+    __slots__ = ("_records", "_keys", "_rows")
+
+    def __init__(self, records):
+        from array import array
+        self._records = records
+        rows = sorted(range(len(records) // _RECORD_SIZE),
+                      key=lambda row: (records[row * _RECORD_SIZE], row))
+        self._rows = array("i", rows)
+        self._keys = array("i", [records[row * _RECORD_SIZE]
+                                 for row in rows])
+
+    def _get_range(self, key):
+        import bisect
+        lo = bisect.bisect_left(self._keys, key)
+        return lo, bisect.bisect_right(self._keys, key, lo)
+
+    def get(self, qualname, default=()):
+        key = _STRINGS.find(qualname)
+        if key < 0:
+            return default
+        lo, hi = self._get_range(key)
+        if lo == hi:
+            return default
+        return [_Binding(self, self._rows[i]) for i in range(lo, hi)]
+
+    def __getitem__(self, qualname):
+        bindings = self.get(qualname, None)
+        if bindings is None:
+            raise KeyError(qualname)
+        return bindings
+
+    def __contains__(self, qualname):
+        return self.get(qualname, None) is not None
+
+    def items(self):
+        """Yield (qualname, bindings) for every name of the table."""
+        i = 0
+        while i < len(self._keys):
+            lo, hi = self._get_range(self._keys[i])
+            yield (_STRINGS[self._keys[i]],
+                   [_Binding(self, self._rows[j]) for j in range(lo, hi)])
+            i = hi
+
+class _SymbolTableVisitor(ast.NodeVisitor):
+    """Build in a single pass the table of all the names bound in a module.
+
+    A binding records its kind ("class", "function", "assign", "import",
+    "star" or "other"), its position, the imported name and module if
+    any, whether it is nested in a compound statement (thus conditionally
+    executed) and its parent class (None at module level).
+
+    Class bodies are visited but not function bodies since their names
+    cannot be reached by attribute access.
+    """
+
+    def __init__(self):
+        from array import array
+        self.records = array("i")
         self.path = []
+        self.parent = -1
+        self.nested = False
+        self.stmt = None
+
+    def get_table(self):
+        return _SymbolTable(self.records)
+
+    def _add(self, name, kind, node, alias=None):
+        intern = _STRINGS.intern
+        qualname = ".".join(self.path + [name])
+        flags = _NESTED if self.nested else 0
+        from_module = -1
+        level = 0
+        if isinstance(node, ast.ImportFrom):
+            flags |= _FROM_IMPORT
+            if node.module:
+                from_module = intern(node.module)
+            level = node.level or 0
+        if alias is not None and alias.asname is not None:
+            flags |= _HAS_ASNAME
+        if kind in ("class", "function"):
+            first_line = _get_first_line(node)
+        else:
+            first_line = node.lineno
+        self.records.extend((
+            intern(qualname), self.parent, _BINDING_KINDS.index(kind),
+            flags, node.lineno, node.col_offset, _get_last_line(node),
+            first_line, -1 if alias is None else intern(alias.name),
+            from_module, level))
+
+    def visit(self, node):
+        if isinstance(node, ast.stmt):
+            self.stmt = node
+        return super(_SymbolTableVisitor, self).visit(node)
 
     def visit_ClassDef(self, node):
-        self.path.append(node)
-        qualname = ".".join(n.name for n in self.path)
-        if qualname == self.qualname:
-            self.candidates.append(node)
-        retval = self.generic_visit(node)
+        row = len(self.records) // _RECORD_SIZE
+        self._add(node.name, "class", node)
+        saved = self.parent, self.nested
+        self.path.append(node.name)
+        self.parent, self.nested = row, False
+        for stmt in node.body:
+            self.visit(stmt)
         self.path.pop()
-        return retval
+        self.parent, self.nested = saved
 
     def visit_FunctionDef(self, node):
+        self._add(node.name, "function", node)
         # Do not descend into FunctionDef
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Assign(self, node):
+        for name_node in _iter_assigned_names(node):
+            self._add(name_node.id, "assign", node)
+        self.visit(node.value)
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            if alias.name == "*":
+                self._add("*", "star", node, alias)
+            else:
+                self._add(alias.asname or alias.name, "import", node, alias)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self._add(alias.asname or alias.name.partition(".")[0],
+                      "import", node, alias)
+
+    def visit_Name(self, node):
+        if not isinstance(node.ctx, ast.Load):
+            self._add(node.id, "other", self.stmt)
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            # A Name node in Python 2.
+            if isinstance(node.name, str):
+                self._add(node.name, "other", self.stmt)
+        self.generic_visit(node)
+
+    def _visit_capture(self, node):
+        for attr in ("name", "rest"):
+            captured = getattr(node, attr, None)
+            if captured:
+                self._add(captured, "other", self.stmt)
+        self.generic_visit(node)
+
+    visit_MatchAs = visit_MatchStar = visit_MatchMapping = _visit_capture
+
+    def _visit_compound(self, node):
+        saved = self.nested
+        self.nested = True
+        self.generic_visit(node)
+        self.nested = saved
+
+    visit_If = visit_For = visit_AsyncFor = visit_While = visit_Try \
+        = visit_TryStar = visit_TryExcept = visit_TryFinally = visit_With \
+        = visit_AsyncWith = visit_Match = _visit_compound
+
+    def _visit_comprehension(self, node):
+        # Comprehension variables do not leak into the enclosing scope.
         pass
 
-def _get_file_content(filename):
-    with open(filename) as f:
-        return f.read()
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp \
+        = _visit_comprehension
+
+def _build_symbol_table(root_node):
+    visitor = _SymbolTableVisitor()
+    with _timed("visit"):
+        visitor.visit(root_node)
+    return visitor.get_table()
+
+@contextlib.contextmanager
+def _map_source(filename):
+    """Give the raw content of *filename* as a read-only bytes-like object.
+
+    Regular files are memory-mapped. Sources are parsed from their bytes
+    without copying or decoding them first, so that their encoding
+    declaration (PEP 263) is honored whatever the locale.
+    """
+    import mmap
+    with _timed("read", filename, "read"):
+        try:
+            stream = open(filename, "rb")
+        except IOError:
+            # Members of zip archives are read at once.
+            data = _read_file_bytes(filename)
+        else:
+            with stream:
+                try:
+                    data = mmap.mmap(stream.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+                except ValueError: # Empty files cannot be mapped.
+                    data = b""
+    try:
+        yield data
+    finally:
+        if not isinstance(data, bytes):
+            data.close()
+
+def _read_file_bytes(filename):
+    """Return the content of *filename*, which may be a file in a zip
+    archive."""
+    try:
+        with open(filename, "rb") as stream:
+            return stream.read()
+    except IOError:
+        member = _get_archive_member(filename)
+        if member is None:
+            raise
+        return member[0].read(member[1])
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+class _LRUCache(object):
+    """Bounded mapping evicting the least recently used entry first.
+
+    Count hits and misses so that cache efficiency can be monitored in
+    long-lived processes. All operations are thread-safe.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # Re-insert to mark it as the most recently used.
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def remove_if(self, predicate):
+        """Remove the entries for which *predicate(key, value)* is true."""
+        with self._lock:
+            for key, value in list(self._data.items()):
+                if predicate(key, value):
+                    del self._data[key]
 
-def _search_classdef(filename, qualname):
-    source = _get_file_content(filename)
-    root_node = ast.parse(source, filename)
-    visitor = _ClassDefVisitor(qualname)
-    visitor.visit(root_node)
-    return visitor.candidates
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._data))
+
+DEFAULT_PARSE_CACHE_SIZE = 64
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_OBJECT_CACHE_SIZE = 16384
+
+def _get_file_key(filename):
+    """Return a key identifying the current content of *filename*.
+
+    The key changes whenever the file is modified, so that cached entries
+    of an out-dated content are never returned.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        member = _get_archive_member(filename)
+        if member is None:
+            raise
+        # Members change only when the archive is modified.
+        zf, info = member
+        return (os.path.realpath(zf.filename) + "/" + info.filename,
+                _get_mtime_ns(os.stat(zf.filename)), info.file_size)
+    return (os.path.realpath(filename), _get_mtime_ns(st), st.st_size)
+
+def _get_mtime_ns(st):
+    mtime = getattr(st, "st_mtime_ns", None)
+    if mtime is None: # Python 2 does not have st_mtime_ns
+        mtime = int(st.st_mtime * 1e9)
+    return mtime
+
+DEFAULT_ARCHIVE_CACHE_SIZE = 16
+
+# Open archives, shared by all the locators like imported modules are.
+_ARCHIVES = _LRUCache(DEFAULT_ARCHIVE_CACHE_SIZE)
+
+def _split_archive_path(filename):
+    """Split *filename* in the path of the archive file containing it and
+    the name of the member in this archive.
+
+    Return None if no parent of *filename* is a file.
+    """
+    parts = []
+    path = filename
+    while True:
+        if os.path.isfile(path):
+            if not parts:
+                return None
+            return path, "/".join(reversed(parts))
+        head, tail = os.path.split(path)
+        if not tail or head == path:
+            return None
+        parts.append(tail)
+        path = head
 
-def _iter_class_methods(obj):
-    for attr in dir(obj):
-        val = getattr(obj, attr)
-        if inspect.isfunction(val) or inspect.ismethod(val):
-            yield val
+def _open_archive(archive):
+    """Return an open ZipFile of *archive*, or None if it is not a zip
+    archive.
+
+    Archives are opened once and their directory is read once, as long as
+    they are not modified.
+    """
+    import zipfile
+    key = _get_file_key(archive)
+    zf = _ARCHIVES.get(key)
+    if zf is None:
+        try:
+            zf = zipfile.ZipFile(archive)
+        except zipfile.BadZipfile:
+            return None
+        _ARCHIVES.put(key, zf)
+    return zf
+
+def _get_archive_member(filename):
+    """Return the open archive containing *filename* (as in the __file__
+    of zip imported modules) and the info of its member, or None."""
+    split = _split_archive_path(filename)
+    if split is None:
+        return None
+    archive, name = split
+    zf = _open_archive(archive)
+    if zf is None:
+        return None
+    try:
+        return zf, zf.getinfo(name)
+    except KeyError:
+        return None
+
+def _source_exists(filename):
+    return os.path.exists(filename) \
+        or _get_archive_member(filename) is not None
+
+def _load_symbol_table(filename, key, tables):
+    with _map_source(filename) as source, \
+         _timed("parse", filename, "parse"):
+        root_node = ast.parse(source, filename)
+    table = _build_symbol_table(root_node)
+    tables.put(key, table)
+    return table
+
+def _get_symbol_table(filename, tables):
+    """Return the symbol table of *filename*, using the *tables* cache."""
+    key = _get_file_key(filename)
+    table = tables.get(key)
+    _emit("cache_miss" if table is None else "cache_hit", filename)
+    if table is None:
+        table = _load_symbol_table(filename, key, tables)
+    return table
+
+def cache_info():
+    """Return hits, misses, maximum and current size of the parse cache of
+    the default locator."""
+    return _DEFAULT_LOCATOR.cache_info()
+
+def clear_cache():
+    """Drop everything cached by the default locator and reset the cache
+    counters."""
+    _DEFAULT_LOCATOR.clear_cache()
+
+# Files smaller than this are always fully parsed: it is fast enough and
+# the symbol table is then cached for the next lookups.
+_PREFILTER_MIN_SIZE = 64 * 1024
+
+# Lines starting like this cannot start a top-level statement.
+_NOT_BLOCK_START_RE = re.compile(br"(?:else|elif|except|finally)\b|[)\]}#\s]")
+
+def _is_block_start(data, pos):
+    """Tell whether the line starting at *pos* in *data* may start a
+    top-level statement."""
+    return pos < len(data) and _NOT_BLOCK_START_RE.match(data, pos) is None
+
+def _next_block_start(data, pos):
+    while True:
+        pos = data.find(b"\n", pos)
+        if pos < 0:
+            return len(data)
+        pos += 1
+        if pos >= len(data) or _is_block_start(data, pos):
+            return pos
+
+def _find_block(data, pos):
+    """Return the offsets of the top-level block enclosing *pos* in *data*.
+
+    Return None if the beginning of the block cannot be found.
+    """
+    start = data.rfind(b"\n", 0, pos) + 1
+    while not _is_block_start(data, start):
+        if start == 0:
+            return None
+        start = data.rfind(b"\n", 0, start - 1) + 1
+    # Decorators belong to the statement they decorate.
+    while start > 0:
+        prev = data.rfind(b"\n", 0, start - 1) + 1
+        if data[prev:prev+1] != b"@":
+            break
+        start = prev
+    end = start
+    while data[end:end+1] == b"@":
+        end = _next_block_start(data, end)
+    return start, _next_block_start(data, end)
+
+def _get_partial_symbol_table(filename, pattern):
+    """Build the symbol table of the top-level blocks of *filename* where
+    *pattern* matches.
+
+    The file is scanned as raw bytes and only the matching blocks are parsed
+    (line numbers are adjusted accordingly). Return None if nothing matches
+    or if the block boundaries cannot be trusted (e.g. a match may be in a
+    multi-line string), in which case the whole file must be parsed.
+    """
+    import io
+    import tokenize
+    if not hasattr(tokenize, "detect_encoding"): # Python 2
+        return None
+    with _map_source(filename) as data:
+        try:
+            blocks = []
+            for mo in pattern.finditer(data):
+                if blocks and mo.start() < blocks[-1][1]:
+                    continue # Already in the previous block.
+                block = _find_block(data, mo.start())
+                if block is None:
+                    return None
+                blocks.append(block)
+            if not blocks:
+                return None
+            if isinstance(data, bytes):
+                readline = io.BytesIO(data).readline
+            else:
+                readline = data.readline
+            encoding, _ = tokenize.detect_encoding(readline)
+            visitor = _SymbolTableVisitor()
+            nlines = 0
+            nquotes = 0
+            prev_end = 0
+            for start, end in blocks:
+                before = data[prev_end:start]
+                nlines += before.count(b"\n")
+                nquotes += before.count(b'"""') + before.count(b"'''")
+                if nquotes % 2 or before.rstrip(b"\r\n").endswith(b"\\"):
+                    # Probably in a multi-line string or a continued line.
+                    return None
+                block = source = data[start:end]
+                if encoding != "utf-8":
+                    # The encoding declaration is not in the block.
+                    source = block.decode(encoding)
+                with _timed("parse", filename, "parse"):
+                    root_node = ast.parse(source, filename)
+                    ast.increment_lineno(root_node, nlines)
+                with _timed("visit"):
+                    visitor.visit(root_node)
+                nlines += block.count(b"\n")
+                nquotes += block.count(b'"""') + block.count(b"'''")
+                prev_end = end
+            return visitor.get_table()
+        except (SyntaxError, ValueError, UnicodeDecodeError):
+            return None
+
+def _get_search_table(filename, name_pattern, tables):
+    """Return a symbol table where all the bindings of a name matching
+    *name_pattern* can be found."""
+    key = _get_file_key(filename)
+    table = tables.get(key)
+    _emit("cache_miss" if table is None else "cache_hit", filename)
+    if table is None and key[2] >= _PREFILTER_MIN_SIZE:
+        # Partial tables are not cached: scanning is cheap enough.
+        table = _get_partial_symbol_table(filename, name_pattern)
+    if table is None:
+        table = _load_symbol_table(filename, key, tables)
+    return table
+
+def _search_classdef(filename, qualname, tables):
+    name = re.escape(qualname.rpartition(".")[2].encode("utf-8"))
+    pattern = re.compile(br"\bclass\s+" + name + br"\b")
+    return [b for b in _get_search_table(filename, pattern, tables)
+            .get(qualname, ())
+            if b.kind == "class"]
+
+def _get_class_namespace(obj):
+    """Return the own namespace of class *obj*.
+
+    The namespace is fetched statically so that no metaclass hook runs.
+    """
+    if not isinstance(obj, type):
+        return obj.__dict__ # Python 2: old-style class.
+    return type.__dict__["__dict__"].__get__(obj, type)
+
+def _iter_own_method_lines(obj):
+    """Yield the first line of the functions defined in the body of class
+    *obj*.
+
+    Only the class own namespace is looked at (inherited methods would not
+    tell where the class is defined) and values are taken as they are
+    stored, without triggering descriptors.
+    """
+    prefix = getattr(obj, "__qualname__", obj.__name__) + "."
+    for val in list(_get_class_namespace(obj).values()):
+        if isinstance(val, (staticmethod, classmethod)):
+            val = val.__func__
+        elif isinstance(val, property):
+            val = val.fget
+        if not inspect.isfunction(val):
+            continue
+        code = val.__code__
+        qualname = getattr(code, "co_qualname",
+                           getattr(val, "__qualname__", None))
+        if qualname is not None and not qualname.startswith(prefix):
+            # Defined somewhere else and assigned in the class body.
+            continue
+        yield code.co_firstlineno
 
 def _get_line(obj):
     if inspect.ismethod(obj):
@@ -119,10 +825,22 @@ def _get_line(obj):
     return None
 
 def _disamb_class_loc(candidates, obj):
-    methods = list(_iter_class_methods(obj))
-    if not methods:
+    firstlineno = _get_class_namespace(obj).get("__firstlineno__")
+    if firstlineno is not None: # Since Python 3.13
+        for c in candidates:
+            if c.first_line == firstlineno:
+                return c
+    meth_line = None
+    for line in _iter_own_method_lines(obj):
+        # The first method found in the span of a candidate proves it is
+        # the right one.
+        for c in candidates:
+            if c.lineno <= line <= c.end_lineno:
+                return c
+        if meth_line is None or line < meth_line:
+            meth_line = line
+    if meth_line is None:
         return
-    meth_line = min(_get_line(m) for m in methods)
     best_candidate = None
     best_dist = None
     # Select the closest candidates coming before the first method definition
@@ -134,151 +852,1787 @@ def _disamb_class_loc(candidates, obj):
                 best_candidate = c
     return best_candidate
 
-def _candidate_nodes_to_locations(filename, candidates):
-    return sorted([Location(filename, c.lineno, c.col_offset)
-                   for c in candidates])
+def _candidate_nodes_to_locations(filename, candidates):
+    return sorted([Location(filename, c.lineno, c.col_offset)
+                   for c in candidates])
+
+def _search_assign(filename, qualname, tables):
+    name = re.escape(qualname.rpartition(".")[2].encode("utf-8"))
+    pattern = re.compile(br"\b" + name + br"\b")
+    return [b for b in _get_search_table(filename, pattern, tables)
+            .get(qualname, ())
+            if b.kind == "assign" or (b.kind == "import" and b.is_from_import)]
+
+def _is_inspectable(obj):
+    return inspect.isclass(obj) \
+        or inspect.ismethod(obj) \
+        or inspect.isfunction(obj) \
+        or inspect.ismodule(obj)
+
+def _find_frozen_file(obj, qualname, filename):
+    mo = re.match(r"^<frozen (.*)>$", filename)
+    if mo:
+        try:
+            mod = importlib.import_module(mo.group(1))
+        except ImportError:
+            pass
+        else:
+            filename = mod.__file__
+    return filename
+
+def _find_file_harder(obj, qualname, filename):
+    strategies = (_find_frozen_file,)
+    i = 0
+    while True:
+        if _source_exists(filename):
+            return filename
+        if i >= len(strategies):
+            raise RuntimeError("failed to get an existing source file name")
+        strategy = strategies[i]
+        filename = strategy(obj, qualname, filename)
+        i += 1
+
+def _get_locatable(obj):
+    """Return the module, class or code object defining *obj*.
+
+    Raise TypeError if *obj* is none of the kind of object accepted by
+    locate_object().
+    """
+    if inspect.iscode(obj): # Most common in profiles.
+        return obj
+    obj = getattr(obj, "__wrapped__", obj)
+    if inspect.ismethod(obj):
+        obj = obj.__func__
+    if inspect.isfunction(obj):
+        obj = obj.__code__
+    if inspect.istraceback(obj):
+        obj = obj.tb_frame
+    if inspect.isframe(obj):
+        obj = obj.f_code
+    if not (inspect.ismodule(obj) or inspect.isclass(obj)
+            or inspect.iscode(obj)):
+        raise TypeError("cannot locate {!r}".format(obj))
+    return obj
+
+def _has_same_filename(locs):
+    filename = locs[0].filename
+    return all(map(lambda x: x.filename == filename, locs))
+
+def _from_pydoc_format(target):
+    """
+    The pydoc target format has no column to separate the package/module part
+    from the object part.
+    """
+    parts = target.split(".")
+    nparts = len(parts)
+    if nparts <= 1:
+        return target
+    if _HAS_FIND_SPEC:
+        mod_part, attrs = _split_pydoc_format(target)
+        if mod_part is None:
+            # Let the import report the error.
+            return target
+        # Only the module finally picked is imported.
+        if attrs:
+            return mod_part + ':' + ".".join(attrs)
+        return mod_part
+    for i in range(nparts, 0, -1):
+        mod_part = ".".join(parts[:i])
+        try:
+            importlib.import_module(mod_part)
+        except ImportError:
+            pass
+        else:
+            qual_part = ".".join(parts[i:])
+            if qual_part:
+                return mod_part + ':' + qual_part
+            return mod_part
+    # We cannot import the target at all. Return it as is. The rest of the
+    # program will report the error.
+    return target
+
+# ============= #
+# Static engine #
+# ============= #
+
+_MAX_STATIC_DEPTH = 8
+
+def _find_spec(name):
+    """Return the module spec of *name* without importing anything.
+
+    Contrary to importlib.util.find_spec, parent packages are not imported:
+    sub-modules are searched in the locations given by the parent's spec.
+    Return None if the module cannot be found this way.
+    """
+    try:
+        import importlib.util
+        import importlib.machinery
+    except ImportError: # Python 2
+        return None
+    module = sys.modules.get(name)
+    if module is not None:
+        return getattr(module, "__spec__", None)
+    parent, _, _ = name.rpartition(".")
+    try:
+        if not parent:
+            return importlib.util.find_spec(name)
+        parent_spec = _find_spec(parent)
+        if parent_spec is None \
+           or parent_spec.submodule_search_locations is None:
+            return None
+        return importlib.machinery.PathFinder.find_spec(
+            name, list(parent_spec.submodule_search_locations))
+    except (ImportError, ValueError):
+        return None
+
+try:
+    import importlib.util
+except ImportError: # Python 2
+    _HAS_FIND_SPEC = False
+else:
+    _HAS_FIND_SPEC = True
+
+_MODULE_PROBES = {}
+_MODULE_PROBES_LOCK = threading.Lock()
+_module_probes_path = None
+
+def _is_module_name(name):
+    """Tell whether *name* names an importable module, without importing it.
+
+    Both positive and negative answers are memoized as long as sys.path
+    does not change and until a locator cache is cleared or invalidated.
+    """
+    global _module_probes_path
+    if name in sys.modules:
+        return True
+    path = tuple(sys.path)
+    with _MODULE_PROBES_LOCK:
+        if path != _module_probes_path:
+            _MODULE_PROBES.clear()
+            _module_probes_path = path
+        found = _MODULE_PROBES.get(name)
+    if found is None:
+        with _timed("find_spec"):
+            found = _find_spec(name) is not None
+        with _MODULE_PROBES_LOCK:
+            _MODULE_PROBES[name] = found
+    return found
+
+def _clear_module_probes():
+    """Forget the memoized module probes, e.g. once modules were added."""
+    with _MODULE_PROBES_LOCK:
+        _MODULE_PROBES.clear()
+    if _HAS_FIND_SPEC:
+        # The finders cache the content of the directories too.
+        importlib.invalidate_caches()
+
+def _get_spec_source(spec):
+    """Return the source file name of the module described by *spec*."""
+    if spec is None:
+        return None
+    try:
+        import importlib.machinery
+    except ImportError: # Python 2
+        return None
+    if spec.has_location:
+        filename = spec.origin
+    else:
+        # Frozen standard modules still know their source file.
+        filename = getattr(spec.loader_state, "filename", None)
+    if not filename \
+       or not filename.endswith(tuple(importlib.machinery.SOURCE_SUFFIXES)):
+        return None
+    return filename
+
+def _get_position(binding):
+    return binding.lineno, binding.col_offset
+
+# Returned by _get_effective_binding() when it cannot decide.
+_AMBIGUOUS = object()
+
+def _get_effective_binding(table, qualname, parent):
+    """Return the binding of *qualname* effective at the end of the execution
+    of the body of class *parent* (or the module if None).
+
+    Return None if *qualname* is not bound at all and _AMBIGUOUS if it
+    cannot be decided statically.
+    """
+    bindings = [b for b in table.get(qualname, ()) if b.parent == parent]
+    if parent is None:
+        # Star imports may bind any name.
+        bindings.extend(table.get("*", ()))
+        bindings.sort(key=_get_position)
+    if not bindings:
+        return None
+    last = bindings[-1]
+    if len(bindings) > 1 and (last.nested or last.kind == "star"):
+        # Either the last binding may not be executed or it may not bind
+        # the name at all.
+        return _AMBIGUOUS
+    return last
+
+def _resolve_import_from(modname, is_package, binding):
+    if not binding.level:
+        return binding.from_module
+    package = modname if is_package else modname.rpartition(".")[0]
+    for _ in range(binding.level - 1):
+        package = package.rpartition(".")[0]
+    if binding.from_module:
+        return package + "." + binding.from_module
+    return package
+
+def _static_locate_module(modname, attrs, tables, depth=0):
+    """Locate *attrs* in module *modname* by reading its source only.
+
+    Return None when it cannot be decided statically.
+    """
+    if depth > _MAX_STATIC_DEPTH:
+        return None
+    with _timed("find_spec"):
+        spec = _find_spec(modname)
+    filename = _get_spec_source(spec)
+    if filename is None:
+        return None
+    if not attrs:
+        return [Location(filename, None, None)]
+    is_package = spec.submodule_search_locations is not None
+    table = _get_symbol_table(filename, tables)
+    parent = None
+    for i, attr in enumerate(attrs):
+        rest = attrs[i+1:]
+        binding = _get_effective_binding(table, ".".join(attrs[:i+1]),
+                                         parent)
+        if binding is None:
+            if i == 0 and is_package:
+                return _static_locate_module(modname + "." + attr, rest,
+                                             tables, depth + 1)
+            return None
+        if binding is _AMBIGUOUS:
+            return None
+        kind = binding.kind
+        if kind == "class":
+            if not rest:
+                return [Location(filename, binding.lineno,
+                                 binding.col_offset)]
+            parent = binding.row
+        elif kind == "function":
+            if rest:
+                return None
+            return [Location(filename, binding.first_line, None)]
+        elif kind == "import" and not binding.is_from_import:
+            if binding.has_asname:
+                target = binding.alias_name
+            else:
+                target = attr
+            return _static_locate_module(target, rest, tables, depth + 1)
+        elif kind in ("import", "star"):
+            from_modname = _resolve_import_from(modname, is_package, binding)
+            name = attr if kind == "star" else binding.alias_name
+            return _static_locate_module(from_modname, [name] + rest,
+                                         tables, depth + 1)
+        else:
+            return None
+
+def _split_pydoc_format(target):
+    """Split a pydoc format *target* in a module name and a list of
+    attributes, without importing anything.
+
+    The module name is the longest prefix naming a module. Return None
+    as module name if there is no such prefix.
+    """
+    parts = target.split(".")
+    nparts = 0
+    for i in range(1, len(parts)+1):
+        if not _is_module_name(".".join(parts[:i])):
+            break
+        nparts = i
+    if nparts == 0:
+        return None, None
+    return ".".join(parts[:nparts]), parts[nparts:]
+
+def _static_locate(target, tables):
+    """Locate *target* without importing its module.
+
+    The module is found using its spec and the object is searched for in
+    its source code. Return None if the location cannot be decided this
+    way (e.g. the name is defined several times or dynamically).
+    """
+    if ":" in target:
+        modname, _, qualname = target.partition(":")
+        attrs = qualname.split(".") if qualname else []
+    else:
+        modname, attrs = _split_pydoc_format(target)
+        if modname is None:
+            return None
+    return _static_locate_module(modname, attrs, tables)
+
+# =============== #
+# Bytecode engine #
+# =============== #
+
+def _get_spec_bytecode(spec):
+    """Return the compiled file and the source file of the module described
+    by *spec*.
+
+    The source file is None for sourceless modules. Return None if the
+    module is not compiled from a Python file.
+    """
+    if spec is None:
+        return None
+    import importlib.machinery
+    import importlib.util
+    if spec.has_location and spec.origin \
+       and spec.origin.endswith(tuple(importlib.machinery.BYTECODE_SUFFIXES)):
+        return spec.origin, None
+    source = _get_spec_source(spec)
+    if source is None:
+        return None
+    try:
+        return importlib.util.cache_from_source(source), source
+    except NotImplementedError: # No cache tag.
+        return None
+
+def _load_pyc(pyc, source):
+    """Return the module code object stored in *pyc*.
+
+    Return None if *pyc* is missing, is not valid for this interpreter or
+    is out-dated with respect to *source* (if not None).
+    """
+    import importlib.util
+    import marshal
+    if sys.version_info < (3, 7): # No PEP 552 header.
+        return None
+    try:
+        with _timed("read", pyc, "read"):
+            data = _read_file_bytes(pyc)
+    except IOError:
+        return None
+    if data[:4] != importlib.util.MAGIC_NUMBER:
+        return None
+    if source is not None:
+        flags = int.from_bytes(data[4:8], "little")
+        if flags & 0x1: # Hash-based
+            source_data = _read_file_bytes(source)
+            if data[8:16] != importlib.util.source_hash(source_data):
+                return None
+        else:
+            _, mtime, size = _get_file_key(source)
+            if int.from_bytes(data[8:12], "little") \
+               != mtime // 10**9 & 0xFFFFFFFF \
+               or int.from_bytes(data[12:16], "little") \
+               != size & 0xFFFFFFFF:
+                return None
+    try:
+        with _timed("unmarshal"):
+            return marshal.loads(data[16:])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+def _get_module_code(pyc, source, codes):
+    """Return the module code object of *pyc*, using the *codes* cache."""
+    try:
+        key = (_get_file_key(pyc),
+               None if source is None else _get_file_key(source))
+    except OSError:
+        return None
+    code = codes.get(key)
+    if code is None:
+        code = _load_pyc(pyc, source)
+        if code is not None:
+            codes.put(key, code)
+    return code
+
+def _is_class_code(code):
+    return not code.co_flags & inspect.CO_NEWLOCALS
+
+def _iter_instructions(code):
+    """Yield the offset, the opcode and the argument of the instructions of
+    *code*.
+
+    Much cheaper than dis.get_instructions() on large modules.
+    """
+    import dis
+    co_code = code.co_code
+    extended = 0
+    for offset in range(0, len(co_code), 2):
+        op = co_code[offset]
+        arg = co_code[offset+1] | extended
+        if op == dis.EXTENDED_ARG:
+            extended = arg << 8
+        else:
+            extended = 0
+            yield offset, op, arg
+
+def _count_stores(code, name):
+    """Return how many times *name* is bound in *code*, or None if it may be
+    bound by a star import."""
+    import dis
+    if ("*",) in code.co_consts:
+        return None
+    try:
+        index = code.co_names.index(name)
+    except ValueError:
+        return 0
+    stores = (dis.opmap["STORE_NAME"], dis.opmap["STORE_GLOBAL"])
+    return sum(1 for _, op, arg in _iter_instructions(code)
+               if op in stores and arg == index)
+
+def _get_class_position(parent, code):
+    """Return the line and column of the class statement whose body is
+    *code*, read from the instruction of *parent* creating it.
+
+    Return None if instructions have no position (before Python 3.11).
+    """
+    import dis
+    if not hasattr(parent, "co_positions"):
+        return None
+    index = [i for i, c in enumerate(parent.co_consts) if c is code][0]
+    load_const = dis.opmap["LOAD_CONST"]
+    for offset, op, arg in _iter_instructions(parent):
+        if op == load_const and arg == index:
+            lineno, _, col, _ = next(itertools.islice(parent.co_positions(),
+                                                      offset // 2, None))
+            if lineno is None:
+                return None
+            return lineno, col
+    return None
+
+def _get_sourceless_file(obj):
+    """Return the compiled file of the module defining *obj* if this module
+    was loaded without source, or None."""
+    try:
+        import importlib.machinery
+    except ImportError: # Python 2
+        return None
+    module = inspect.getmodule(obj)
+    if isinstance(getattr(module, "__loader__", None),
+                  importlib.machinery.SourcelessFileLoader):
+        return module.__file__
+    return None
+
+def _bytecode_locate_code(filename, code, attrs):
+    """Locate *attrs* in the module compiled to *code*, reporting
+    *filename*.
+
+    Only classes and functions can be located this way. Return None when
+    the object is not found, is bound several times or is not a class or
+    a function.
+    """
+    parent = None
+    in_locals = False
+    for attr in attrs:
+        if attr == "<locals>":
+            if _is_class_code(code):
+                return None
+            in_locals = True
+            continue
+        if not in_locals and not _is_class_code(code):
+            return None # Function attribute.
+        found = [c for c in code.co_consts
+                 if inspect.iscode(c) and c.co_name == attr]
+        if len(found) != 1:
+            return None
+        if not in_locals and _count_stores(code, attr) != 1:
+            return None
+        parent, code = code, found[0]
+        in_locals = False
+    if not _is_class_code(code):
+        return [Location(filename, code.co_firstlineno, None)]
+    position = _get_class_position(parent, code)
+    if position is None:
+        return None
+    return [Location(filename, position[0], position[1])]
+
+def _bytecode_locate(target, codes):
+    """Locate the class or function *target* using the cached compiled
+    module, without importing or parsing it.
+
+    Return None if the compiled module is missing or out-dated, or if the
+    object cannot be located this way.
+    """
+    if ":" in target:
+        modname, _, qualname = target.partition(":")
+        attrs = qualname.split(".") if qualname else []
+    else:
+        modname, attrs = _split_pydoc_format(target)
+    if not attrs:
+        return None
+    with _timed("find_spec"):
+        spec = _find_spec(modname)
+    files = _get_spec_bytecode(spec)
+    if files is None:
+        return None
+    pyc, source = files
+    code = _get_module_code(pyc, source, codes)
+    if code is None:
+        return None
+    return _bytecode_locate_code(source or pyc, code, attrs)
+
+# ===== #
+# Index #
+# ===== #
+
+def _default_index_path():
+    import hashlib
+    cache_dir = os.environ.get("XDG_CACHE_HOME",
+                               os.path.join(os.path.expanduser("~"), ".cache"))
+    # One index per installation since they have different sys.path.
+    prefix_hash = hashlib.sha1(sys.prefix.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(
+        cache_dir, "pyloc",
+        "index-py{v.major}{v.minor}-{h}.sqlite"
+        .format(v=sys.version_info, h=prefix_hash))
+
+def _iter_definitions(table):
+    """Yield (qualname, kind, line, column, alias) of every binding in
+    symbol *table* except star imports.
+
+    Lines and columns are those reported by the import engine. *alias*
+    tells whether an import binds another name than the module it imports
+    (a "from" import or an "as" clause).
+    """
+    for qualname, bindings in table.items():
+        for b in bindings:
+            if b.kind == "star":
+                continue
+            alias = b.kind == "import" and (b.is_from_import or b.has_asname)
+            if b.kind == "function":
+                yield qualname, b.kind, b.first_line, None, alias
+            else:
+                yield qualname, b.kind, b.lineno, b.col_offset, alias
+
+def _is_identifier(name):
+    return re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", name) is not None
+
+def _iter_module_files(dirpath, modname):
+    """Yield (module name, file name) of every module of package *modname*
+    located in *dirpath*."""
+    for entry in sorted(os.listdir(dirpath)):
+        filename = os.path.join(dirpath, entry)
+        name, ext = os.path.splitext(entry)
+        if ext == ".py":
+            if name == "__init__":
+                yield modname, filename
+            elif _is_identifier(name):
+                yield modname + "." + name, filename
+        elif _is_identifier(entry) \
+             and os.path.isfile(os.path.join(filename, "__init__.py")):
+            for m in _iter_module_files(filename, modname + "." + entry):
+                yield m
+
+def _iter_path_modules(path=None):
+    """Yield (module name, file name) of every module source importable
+    from *path* (default to sys.path).
+
+    By default, the current directory and the directory of the running
+    script are left out: what they contain depends on where and how
+    Python is started.
+    """
+    import pkgutil
+    if path is None:
+        path = sys.path
+        if path and not getattr(sys.flags, "safe_path", False):
+            path = path[1:]
+        path = [entry for entry in path if entry]
+    seen = set()
+    for entry in path:
+        entry = os.path.abspath(entry or os.curdir)
+        if not os.path.isdir(entry):
+            continue
+        for _, name, ispkg in pkgutil.iter_modules([entry]):
+            if name in seen:
+                continue # Shadowed by a previous sys.path entry.
+            seen.add(name)
+            if ispkg:
+                pkgdir = os.path.join(entry, name)
+                if os.path.isfile(os.path.join(pkgdir, "__init__.py")):
+                    for m in _iter_module_files(pkgdir, name):
+                        yield m
+            else:
+                filename = os.path.join(entry, name + ".py")
+                if os.path.isfile(filename):
+                    yield name, filename
+
+def _extract_file_symbols(filename):
+    """Return the symbols defined in *filename* or an empty list if it
+    cannot be parsed."""
+    try:
+        with _map_source(filename) as source:
+            root_node = ast.parse(source, filename)
+    except (SyntaxError, ValueError, UnicodeDecodeError, IOError):
+        return []
+    return list(_iter_definitions(_build_symbol_table(root_node)))
+
+# Bumped whenever the schema changes. Indexes of another version are
+# emptied: they are rebuilt by the next refresh.
+_INDEX_VERSION = 2
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    module TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    module TEXT NOT NULL,
+    qualname TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    line INTEGER,
+    col INTEGER,
+    alias INTEGER NOT NULL,
+    filename TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_module ON files (module);
+CREATE INDEX IF NOT EXISTS symbols_qualname ON symbols (module, qualname);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name);
+CREATE INDEX IF NOT EXISTS symbols_filename ON symbols (filename);
+"""
+
+# Kinds of the definitions returned by a search.
+_SEARCH_KINDS = ("class", "function", "assign")
+
+Definition = namedtuple('Definition', 'target kind filename line column')
+
+def _definition_rank(definition):
+    """Sort key of *definition* in search results: shortest module path
+    first."""
+    modname, _, qualname = definition.target.partition(":")
+    return (modname.count("."), len(modname), modname,
+            qualname.count("."), qualname, definition.line or 0)
+
+IndexStats = namedtuple('IndexStats', 'files parsed removed')
+
+# Below this number of files, starting worker processes costs more than it
+# saves.
+_MIN_FILES_PER_JOB = 16
+
+def _map_files(func, filenames, jobs=1):
+    """Iterate over *func* applied to every file of *filenames*.
+
+    Calls are spread over *jobs* worker processes (default to the number
+    of CPUs if None). *func* must be a module level function returning
+    picklable values.
+    """
+    if jobs is None:
+        import multiprocessing
+        try:
+            jobs = multiprocessing.cpu_count()
+        except NotImplementedError:
+            jobs = 1
+    jobs = min(jobs, len(filenames) // _MIN_FILES_PER_JOB)
+    if jobs <= 1:
+        return map(func, filenames)
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError: # Python 2
+        return map(func, filenames)
+    def _iter_results():
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # Big chunks limit inter-process communication while several
+            # chunks per worker balance the load.
+            chunksize = max(1, len(filenames) // (jobs * 8))
+            for result in pool.map(func, filenames, chunksize=chunksize):
+                yield result
+    return _iter_results()
+
+class _NameTrie(object):
+    """Prefix tree of the names "module[:qualname]".
+
+    The names are stored in a single sorted sequence of unique names rather
+    than in nodes: the names below a node are contiguous in the sequence
+    and its children are enumerated by jumping over their range by
+    bisection, so that completing a prefix costs one bisection per
+    completion.
+    """
+
+    _SEPARATOR_RE = re.compile(r"[.:]")
+
+    def __init__(self, names):
+        self._names = names
+
+    def __len__(self):
+        return len(self._names)
+
+    def complete(self, prefix):
+        """Return the sorted names starting with *prefix*, up to the next
+        "." or ":" that follows it."""
+        import bisect
+        names = self._names
+        completions = set()
+        i = bisect.bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            name = names[i]
+            m = self._SEPARATOR_RE.search(name, len(prefix))
+            if m is None:
+                completions.add(name)
+                i += 1
+            else:
+                child = name[:m.start()]
+                completions.add(child)
+                # Skip the names below this child. Below the same child,
+                # names continuing with the other separator are further.
+                i = bisect.bisect_left(names, child + chr(ord(m.group()) + 1),
+                                       i)
+        return sorted(completions)
+
+_MAP_MAGIC = b"PYLOCIX1"
+
+# Magic, mtime and size of the index database it was written from, number
+# of strings, files, symbols, completion names and buckets of the target,
+# module and name hash tables.
+_MAP_HEADER = "=8sqqIIIIIII4x"
+
+# Filename, module, mtime and size.
+_MAP_FILE = "=iiqq"
+
+# Number of int32 fields of a symbol record: file, module, qualname, name,
+# kind, line and column (-1 if None).
+_MAP_SYMBOL_FIELDS = 7
+
+# Number of uint32 fields of a hash table bucket: hash, start and count of
+# the matching range (0 in empty buckets).
+_MAP_BUCKET_FIELDS = 3
+
+def _hash_name(name):
+    import zlib
+    # Unlike hash(), the same in all processes.
+    return zlib.crc32(name.encode("utf-8")) & 0xffffffff
+
+def _build_hash_table(keys):
+    """Return the number of buckets and the buckets of the open addressing
+    hash table of the ranges of equal *keys*, which must be sorted."""
+    from array import array
+    ranges = []
+    start = 0
+    for key, group in itertools.groupby(keys):
+        count = len(list(group))
+        ranges.append((key, start, count))
+        start += count
+    nbuckets = 1
+    while nbuckets < 2 * len(ranges):
+        nbuckets *= 2
+    mask = nbuckets - 1
+    buckets = [0] * (_MAP_BUCKET_FIELDS * nbuckets)
+    for key, start, count in ranges:
+        h = _hash_name(key)
+        i = _MAP_BUCKET_FIELDS * (h & mask)
+        while buckets[i + 2]:
+            i = (i + _MAP_BUCKET_FIELDS) % len(buckets)
+        buckets[i:i + _MAP_BUCKET_FIELDS] = h, start, count
+    return nbuckets, array("I", buckets)
+
+def _write_index_map(stream, key, db):
+    """Write the files and symbols of the index database *db*, whose file
+    key is *key*, to *stream*, to be read back by _MappedIndex.
+
+    The map is made of fixed-width file and symbol records sorted by
+    module and qualified name, a table of the names to complete sorted by
+    name, hash tables of the records of a module, of a target and of a bare
+    name and a table of all the strings they refer to.
+    """
+    import struct
+    from array import array
+    strings = {}
+    def intern(s):
+        return strings.setdefault(s, len(strings))
+    # SQLite sorts UTF-8 strings in the same order as Python, using the
+    # indexes, and keeps the bindings of a name in the order they were
+    # stored.
+    files = db.execute("SELECT module, filename, mtime, size FROM files "
+                       "ORDER BY module, filename").fetchall()
+    file_ids = dict((f[1], i) for i, f in enumerate(files))
+    symbols = db.execute("SELECT module, qualname, name, kind, line, col, "
+                         "filename FROM symbols "
+                         "ORDER BY module, qualname").fetchall()
+    kinds = dict((k, i) for i, k in enumerate(_BINDING_KINDS))
+    records = array("i")
+    for modname, qualname, name, kind, line, col, filename in symbols:
+        records.extend((file_ids[filename], intern(modname), intern(qualname),
+                        intern(name), kinds[kind],
+                        -1 if line is None else line,
+                        -1 if col is None else col))
+    postings = array("I", sorted(range(len(symbols)),
+                                 key=lambda i: symbols[i][2]))
+    # Unique names to complete, referring to their first symbol or, after
+    # the symbols, to their first file.
+    completions = {}
+    for i in range(len(symbols) - 1, -1, -1):
+        completions[symbols[i][0] + ":" + symbols[i][1]] = i
+    for i in range(len(files) - 1, -1, -1):
+        completions[files[i][0]] = len(symbols) + i
+    names = array("I", [completions[n] for n in sorted(completions)])
+    tables = [_build_hash_table(keys) for keys in (
+        (s[0] + ":" + s[1] for s in symbols),
+        (f[0] for f in files),
+        (symbols[i][2] for i in postings))]
+    file_records = [struct.pack(_MAP_FILE, intern(filename), intern(modname),
+                                mtime, size)
+                    for modname, filename, mtime, size in files]
+    data = [s.encode("utf-8")
+            for s, _ in sorted(strings.items(), key=lambda i: i[1])]
+    offsets = array("I", [0])
+    for d in data:
+        offsets.append(offsets[-1] + len(d))
+    stream.write(struct.pack(_MAP_HEADER, _MAP_MAGIC, key[1], key[2],
+                             len(data), len(files), len(symbols), len(names),
+                             *[t[0] for t in tables]))
+    stream.write(b"".join(file_records))
+    for section in [offsets, records, postings, names] + [t[1] for t in tables]:
+        try:
+            stream.write(section.tobytes())
+        except AttributeError: # Python 2
+            stream.write(section.tostring())
+    stream.write(b"".join(data))
+
+class _MappedIndex(object):
+    """Read the index map written by _write_index_map() in *data* in place.
+
+    *data* is usually a memory-mapped file, so that opening the map costs
+    nothing whatever its size and all the processes reading it share the
+    same pages. Raise ValueError if it was not written for the index whose
+    file key is *key*.
+    """
+
+    def __init__(self, data, key):
+        import struct
+        header = struct.Struct(_MAP_HEADER)
+        try:
+            fields = header.unpack_from(data)
+        except struct.error:
+            fields = (None,)
+        if fields[0] != _MAP_MAGIC or fields[1:3] != key[1:]:
+            raise ValueError("out-dated index map")
+        nstrings, nfiles, nsymbols, nnames = fields[3:7]
+        self._data = data
+        self._file = struct.Struct(_MAP_FILE)
+        self._nsymbols = nsymbols
+        self._files_at = header.size
+        pos = [header.size + self._file.size * nfiles]
+        def section(fmt, count):
+            start = pos[0]
+            pos[0] += 4 * count
+            if pos[0] > len(data):
+                raise ValueError("truncated index map")
+            if not hasattr(memoryview, "cast"): # Python 2
+                from array import array
+                items = array(fmt)
+                items.fromstring(data[start:pos[0]])
+                return items
+            return memoryview(data)[start:pos[0]].cast(fmt)
+        self._offsets = section("I", nstrings + 1)
+        self._symbols = section("i", _MAP_SYMBOL_FIELDS * nsymbols)
+        self._postings = section("I", nsymbols)
+        self._names = section("I", nnames)
+        self._targets, self._modules, self._by_name = [
+            section("I", _MAP_BUCKET_FIELDS * n) for n in fields[7:10]]
+        self._base = pos[0]
+
+    def _string(self, i):
+        return self._data[self._base + self._offsets[i]:
+                          self._base + self._offsets[i + 1]].decode("utf-8")
+
+    def _get_file(self, i):
+        filename, modname, mtime, size = self._file.unpack_from(
+            self._data, self._files_at + self._file.size * i)
+        return self._string(filename), self._string(modname), mtime, size
+
+    def _get_target(self, i):
+        at = _MAP_SYMBOL_FIELDS * i
+        return (self._string(self._symbols[at + 1]),
+                self._string(self._symbols[at + 2]))
+
+    def _get_symbol(self, i):
+        """Return the module, qualified name, kind, line, column, filename,
+        mtime and size of the file of the *i*-th symbol."""
+        f, _, _, _, kind, line, col = self._symbols[
+            _MAP_SYMBOL_FIELDS * i:_MAP_SYMBOL_FIELDS * (i + 1)].tolist()
+        filename, _, mtime, size = self._get_file(f)
+        return self._get_target(i) + (
+            _BINDING_KINDS[kind], None if line < 0 else line,
+            None if col < 0 else col, filename, mtime, size)
+
+    def _probe(self, buckets, name, match):
+        """Return the range of the records of *name* in hash table *buckets*
+        verified by *match* (called with the start of a candidate range)."""
+        h = _hash_name(name)
+        mask = len(buckets) // _MAP_BUCKET_FIELDS - 1
+        i = h & mask
+        while True:
+            bh, start, count = buckets[_MAP_BUCKET_FIELDS * i:
+                                       _MAP_BUCKET_FIELDS * (i + 1)].tolist()
+            if count == 0:
+                return range(0)
+            if bh == h and match(start):
+                return range(start, start + count)
+            i = (i + 1) & mask
+
+    def find_module(self, modname):
+        """Return the filename, mtime and size of the files of module
+        *modname*."""
+        files = [self._get_file(i) for i in self._probe(
+            self._modules, modname,
+            lambda i: self._get_file(i)[1] == modname)]
+        return [(f[0], f[2], f[3]) for f in files]
+
+    def find_target(self, modname, qualname):
+        """Return the symbols (see _get_symbol()) bound to *qualname* in
+        module *modname*."""
+        return [self._get_symbol(i) for i in self._probe(
+            self._targets, modname + ":" + qualname,
+            lambda i: self._get_target(i) == (modname, qualname))]
+
+    def find_name(self, name):
+        """Return the symbols (see _get_symbol()) whose bare name is
+        *name*."""
+        def get_name(i):
+            return self._string(self._symbols[
+                _MAP_SYMBOL_FIELDS * self._postings[i] + 3])
+        return [self._get_symbol(self._postings[i]) for i in self._probe(
+            self._by_name, name, lambda i: get_name(i) == name)]
+
+    def get_names(self):
+        """Return the sorted sequence of the names to complete."""
+        return _MappedNames(self)
+
+def _read_index_map(filename, key):
+    """Return the _MappedIndex of the map *filename*, mapped in memory."""
+    import mmap
+    with open(filename, "rb") as stream:
+        return _MappedIndex(mmap.mmap(stream.fileno(), 0,
+                                      access=mmap.ACCESS_READ), key)
+
+class _MappedNames(object):
+    """Sequence of the sorted names of a _MappedIndex *index*, decoded when
+    accessed."""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return len(self._index._names)
+
+    def __getitem__(self, i):
+        index = self._index
+        ref = index._names[i]
+        if ref >= index._nsymbols:
+            return index._get_file(ref - index._nsymbols)[1]
+        return ":".join(index._get_target(ref))
+
+def _is_imported_from(modname, filename):
+    """Tell whether module *modname* would be imported from *filename*
+    (always true if it cannot be told)."""
+    if not _HAS_FIND_SPEC:
+        return True
+    spec = _find_spec(modname)
+    return spec is not None and spec.origin is not None \
+        and os.path.abspath(spec.origin) == filename
+
+class Index(object):
+    """On-disk index of the symbols defined in the modules of sys.path.
+
+    The index is stored in a SQLite database. Each file is recorded with
+    its modification time and size so that a refresh only parses the files
+    that changed and a lookup can tell whether its answer is out-dated.
+
+    Queries are answered from a map of the database, saved next to it by
+    each refresh, which is read in place from memory: opening it costs
+    nothing and processes querying the same index share its pages.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._map = None
+        self._map_lock = threading.Lock()
+
+    def _connect(self):
+        # SQLite connections cannot be shared between threads.
+        db = getattr(self._local, "db", None)
+        if db is None:
+            import sqlite3
+            dirpath = os.path.dirname(self.path)
+            if dirpath and not os.path.isdir(dirpath):
+                os.makedirs(dirpath)
+            db = sqlite3.connect(self.path)
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version != _INDEX_VERSION:
+                with db:
+                    db.execute("DROP TABLE IF EXISTS files")
+                    db.execute("DROP TABLE IF EXISTS symbols")
+                    db.execute("PRAGMA user_version = {}"
+                               .format(_INDEX_VERSION))
+            db.executescript(_INDEX_SCHEMA)
+            self._local.db = db
+        return db
+
+    def refresh(self, path=None, jobs=1):
+        """Index modules from *path* (default to sys.path) whose file
+        changed since last refresh and forget about removed ones.
+
+        Files are parsed by *jobs* processes (default to the number of
+        CPUs if None).
+        """
+        stats = self._update(_iter_path_modules(path), jobs)
+        # Written now so that the first query is fast.
+        self._get_map()
+        return stats
+
+    def _update(self, modules, jobs):
+        """Index the files of *modules*, an iterable of (module name, file
+        name), that changed since last indexed and forget about the others.
+        """
+        db = self._connect()
+        known = dict((row[0], (row[1], row[2])) for row in
+                     db.execute("SELECT filename, mtime, size FROM files"))
+        seen = set()
+        changed = []
+        for modname, filename in modules:
+            if filename in seen:
+                continue
+            seen.add(filename)
+            _, mtime, size = _get_file_key(filename)
+            if known.get(filename) != (mtime, size):
+                changed.append((filename, modname, mtime, size))
+        with db:
+            all_symbols = _map_files(_extract_file_symbols,
+                                     [c[0] for c in changed], jobs)
+            for c, symbols in zip(changed, all_symbols):
+                self._store(db, *(c + (symbols,)))
+            removed = [f for f in known if f not in seen]
+            for filename in removed:
+                self._forget(db, filename)
+        return IndexStats(len(seen), len(changed), len(removed))
+
+    def _forget(self, db, filename):
+        db.execute("DELETE FROM files WHERE filename = ?", (filename,))
+        db.execute("DELETE FROM symbols WHERE filename = ?", (filename,))
+
+    def _store(self, db, filename, modname, mtime, size, symbols):
+        self._forget(db, filename)
+        db.execute("INSERT INTO files VALUES (?, ?, ?, ?)",
+                   (filename, modname, mtime, size))
+        db.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       [(modname, q, q.rpartition(".")[2], k, l, c, int(a),
+                         filename)
+                        for q, k, l, c, a in symbols])
+
+    def _is_up_to_date(self, filename, mtime, size):
+        try:
+            return _get_file_key(filename)[1:] == (mtime, size)
+        except OSError:
+            return False
+
+    def _split(self, index_map, target):
+        if ":" in target:
+            modname, _, qualname = target.partition(":")
+            return modname, qualname
+        parts = target.split(".")
+        for i in range(len(parts), 0, -1):
+            modname = ".".join(parts[:i])
+            if index_map.find_module(modname):
+                return modname, ".".join(parts[i:])
+        return None, None
+
+    def lookup(self, target):
+        """Return the location of *target* or None if the index cannot tell.
+
+        Only modules and unambiguous class and function definitions are
+        answered, and only if their file did not change since indexed.
+        """
+        index_map = self._get_map()
+        modname, qualname = self._split(index_map, target)
+        if modname is None:
+            return None
+        if not qualname:
+            files = index_map.find_module(modname)
+            if len(files) != 1:
+                return None
+            filename, mtime, size = files[0]
+            location = Location(filename, None, None)
+        else:
+            symbols = index_map.find_target(modname, qualname)
+            if len(symbols) != 1 or symbols[0][2] not in ("class", "function"):
+                return None
+            _, _, _, line, col, filename, mtime, size = symbols[0]
+            location = Location(filename, line, col)
+        if not self._is_up_to_date(filename, mtime, size) \
+           or not _is_imported_from(modname, filename):
+            return None
+        return [location]
+
+    def search(self, name):
+        """Return the definitions (classes, functions and assignments) of
+        *name* in all the modules of the index.
+
+        *name* is a bare name, which is the last part of the qualified name
+        of the definitions. They are ranked with the shortest module path
+        first. Files changed since indexed are parsed again, but files
+        defining *name* only since are not found until the next refresh.
+        """
+        files = OrderedDict()
+        for modname, qualname, kind, line, col, filename, mtime, size \
+                in self._get_map().find_name(name):
+            if kind in _SEARCH_KINDS:
+                files.setdefault((filename, modname, mtime, size), []).append(
+                    (qualname, kind, line, col))
+        definitions = []
+        for (filename, modname, mtime, size), symbols in files.items():
+            if not self._is_up_to_date(filename, mtime, size):
+                if not os.path.exists(filename):
+                    continue
+                symbols = [s[:4] for s in _extract_file_symbols(filename)
+                           if s[0].rpartition(".")[2] == name
+                           and s[1] in _SEARCH_KINDS]
+            definitions.extend(
+                Definition(modname + ":" + qualname, kind, filename, line, col)
+                for qualname, kind, line, col in symbols)
+        definitions.sort(key=_definition_rank)
+        return definitions
+
+    def complete(self, prefix):
+        """Return the names of the modules and symbols of the index
+        completing *prefix* (see Locator.complete())."""
+        return _NameTrie(self._get_map().get_names()).complete(prefix)
+
+    def _get_map(self):
+        with self._map_lock:
+            try:
+                key = _get_file_key(self.path)
+            except OSError:
+                key = None
+            cached = self._map
+            if cached is None or cached[0] != key:
+                cached = self._map = self._open_map(key)
+            return cached[1]
+
+    def _open_map(self, key):
+        """Return the file key of the database and its map."""
+        import io
+        map_path = self.path + ".map"
+        # Up-to-date maps are read without opening the database.
+        if key is not None:
+            try:
+                return key, _read_index_map(map_path, key)
+            except (IOError, ValueError):
+                pass
+        # Missing or out-dated: written once for all the processes.
+        db = self._connect()
+        key = _get_file_key(self.path) # It may have been created or emptied.
+        tmp = "{}.{}.tmp".format(map_path, os.getpid())
+        try:
+            with open(tmp, "wb") as stream:
+                _write_index_map(stream, key, db)
+            os.rename(tmp, map_path)
+            return key, _read_index_map(map_path, key)
+        except (IOError, OSError):
+            # Queries still work, only from private memory.
+            stream = io.BytesIO()
+            _write_index_map(stream, key, db)
+            return key, _MappedIndex(stream.getvalue(), key)
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+def _get_index(path):
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(path)
+        if index is None:
+            index = _INDEXES[path] = Index(path)
+        return index
+
+def build_index(path=None, search_path=None, jobs=None):
+    """Create or refresh the index stored at *path*.
+
+    Only files changed since the last refresh are parsed, using *jobs*
+    processes (default to the number of CPUs).
+    """
+    if path is None:
+        path = _default_index_path()
+    return _get_index(path).refresh(search_path, jobs=jobs)
+
+# ============== #
+# Reverse lookup #
+# ============== #
+
+class _SpanIndex(object):
+    """Interval index of the lines spanned by the classes and functions of
+    a symbol *table*.
+
+    Definitions are nested or disjoint, so their spans are flattened into
+    sorted segments of consecutive lines enclosed by the same innermost
+    definition: the one enclosing a line is found by bisection.
+    """
+
+    def __init__(self, table):
+        spans = sorted(
+            ((b.first_line, -b.end_lineno, qualname)
+             for qualname, bindings in table.items()
+             for b in bindings if b.kind in ("class", "function")),
+            key=lambda span: span[:2])
+        # Segment starts and their innermost definition, None at module
+        # level. Of segments starting on the same line, the last one wins.
+        self._starts = [0]
+        self._qualnames = [None]
+        stack = []
+        def close_until(line):
+            while stack and stack[-1][0] < line:
+                end, _ = stack.pop()
+                self._starts.append(end + 1)
+                self._qualnames.append(stack[-1][1] if stack else None)
+        for start, neg_end, qualname in spans:
+            close_until(start)
+            self._starts.append(start)
+            self._qualnames.append(qualname)
+            stack.append((-neg_end, qualname))
+        close_until(float("inf"))
+
+    def find(self, line):
+        """Return the qualified name of the innermost class or function
+        enclosing *line*, or None if at module level."""
+        import bisect
+        return self._qualnames[bisect.bisect_right(self._starts, line) - 1]
+
+def _get_module_name(filename):
+    """Return the name of the module whose source is *filename*, or None
+    if it is not importable from sys.path."""
+    path = os.path.realpath(filename)
+    for name, module in list(sys.modules.items()):
+        modfile = getattr(module, "__file__", None)
+        if name != "__main__" and modfile \
+           and os.path.realpath(modfile) == path:
+            return name
+    best = None
+    for entry in sys.path:
+        entry = os.path.realpath(entry or os.curdir)
+        if not path.startswith(entry + os.sep):
+            continue
+        parts = os.path.splitext(path[len(entry) + 1:])[0].split(os.sep)
+        if parts[-1] == "__init__":
+            parts.pop()
+        if parts and all(_is_identifier(part) for part in parts) \
+           and (best is None or len(parts) < len(best)):
+            best = parts
+    return None if best is None else ".".join(best)
+
+# ==== #
+# Tags #
+# ==== #
+
+TAG_FORMATS = ("ctags", "etags", "json")
+
+# Default output file of each tags format.
+_TAG_FILES = {"ctags": "tags", "etags": "TAGS", "json": "tags.json"}
+
+# Kinds of definitions that are tagged, with their ctags kind letter. Only
+# imports binding an alias are tagged: "import os" does not define "os".
+_CTAGS_KINDS = {"class": "c", "function": "f", "assign": "v", "import": "x"}
+
+_Tag = namedtuple('_Tag', 'name qualname module kind filename line column')
+
+def _default_tags_cache_path(package, output):
+    import hashlib
+    cache_dir = os.environ.get("XDG_CACHE_HOME",
+                               os.path.join(os.path.expanduser("~"), ".cache"))
+    key = "{}\0{}\0{}".format(sys.prefix, package, os.path.abspath(output))
+    return os.path.join(
+        cache_dir, "pyloc",
+        "tags-{}.sqlite".format(hashlib.sha1(key.encode("utf-8"))
+                                .hexdigest()[:8]))
+
+def _iter_package_modules(package):
+    """Yield (module name, file name) of every module of *package*, which
+    is either a directory or the name of a module or a package."""
+    if os.path.isdir(package):
+        for m in _iter_path_modules([package]):
+            yield m
+        return
+    spec = _find_spec(package)
+    if spec is None:
+        raise PylocError("cannot find package '{}'".format(package))
+    if spec.submodule_search_locations is None:
+        source = _get_spec_source(spec)
+        if source is None:
+            raise PylocError("cannot find the source of '{}'".format(package))
+        yield package, source
+        return
+    for location in spec.submodule_search_locations:
+        if os.path.isfile(os.path.join(location, "__init__.py")):
+            for m in _iter_module_files(location, package):
+                yield m
+
+def _get_tag_path(filename, basedir):
+    """Return *filename* relative to *basedir* if it is below it."""
+    if filename.startswith(basedir + os.sep):
+        return filename[len(basedir) + 1:]
+    return filename
+
+def _write_ctags(stream, tags, basedir):
+    stream.write("!_TAG_FILE_FORMAT\t2\t/extended format/\n")
+    stream.write("!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted, 2=foldcase/\n")
+    stream.write("!_TAG_PROGRAM_NAME\tpyloc\t//\n")
+    for tag in sorted(tags, key=lambda t: (t.name, t.filename, t.line)):
+        kind = _CTAGS_KINDS[tag.kind]
+        scope = tag.qualname.rpartition(".")[0]
+        if scope and kind == "f":
+            kind = "m"
+        stream.write("{}\t{}\t{};\"\t{}".format(
+            tag.name, _get_tag_path(tag.filename, basedir), tag.line, kind))
+        if scope:
+            stream.write("\tclass:{}".format(scope))
+        stream.write("\n")
+
+def _write_etags(stream, tags, basedir):
+    for filename, file_tags in itertools.groupby(tags, lambda t: t.filename):
+        try:
+            with open(filename, "rb") as source:
+                lines = source.read().splitlines(True)
+        except IOError:
+            continue
+        offsets = [0]
+        for line in lines:
+            offsets.append(offsets[-1] + len(line))
+        section = []
+        for tag in file_tags:
+            if not 0 < tag.line <= len(lines):
+                continue
+            text = lines[tag.line - 1].rstrip().decode("utf-8", "replace")
+            section.append(u"{}\x7f{}\x01{},{}\n".format(
+                text, tag.name, tag.line, offsets[tag.line - 1]))
+        section = u"".join(section).encode("utf-8")
+        stream.write(u"\x0c\n{},{}\n".format(
+            _get_tag_path(filename, basedir), len(section)).encode("utf-8"))
+        stream.write(section)
+
+def _write_json_tags(stream, tags, basedir):
+    import json
+    for tag in tags:
+        stream.write(json.dumps(OrderedDict([
+            ("name", tag.name),
+            ("qualname", tag.qualname),
+            ("module", tag.module),
+            ("path", _get_tag_path(tag.filename, basedir)),
+            ("line", tag.line),
+            ("column", tag.column),
+            ("kind", tag.kind),
+        ])))
+        stream.write("\n")
+
+def build_tags(package, output=None, format="ctags", jobs=None, cache=None):
+    """Write the tags of every class, function, assignment and aliasing
+    import of *package* to *output* (default to the usual file name of
+    *format*).
+
+    *package* is the name of a module or a package, or a directory whose
+    modules and packages are all tagged. *format* is one of TAG_FORMATS:
+    "ctags" for vi, "etags" for Emacs or "json" for one JSON object per
+    line. File names below the directory of *output* are relative to it.
+
+    The definitions of each file are kept in a *cache* index, so that only
+    the files changed since the last run are parsed again, by *jobs*
+    processes (default to the number of CPUs). Return the IndexStats of
+    the cache.
+    """
+    if format not in TAG_FORMATS:
+        raise ValueError("unsupported tags format: {}".format(format))
+    if output is None:
+        output = _TAG_FILES[format]
+    if cache is None:
+        cache = _default_tags_cache_path(package, output)
+    index = Index(cache)
+    stats = index._update(_iter_package_modules(package), jobs)
+    rows = index._connect().execute(
+        "SELECT module, qualname, kind, line, col, filename FROM symbols "
+        "WHERE kind IN ({}) AND (kind != 'import' OR alias) "
+        "ORDER BY filename, line, col"
+        .format(", ".join("?" * len(_CTAGS_KINDS))),
+        tuple(_CTAGS_KINDS))
+    tags = [_Tag(qualname.rpartition(".")[2], qualname, modname, kind,
+                 filename, line, col)
+            for modname, qualname, kind, line, col, filename in rows]
+    write = {"ctags": _write_ctags,
+             "etags": _write_etags,
+             "json": _write_json_tags}[format]
+    basedir = os.path.dirname(os.path.realpath(output))
+    tmp = "{}.{}.tmp".format(output, os.getpid())
+    with open(tmp, "wb" if format == "etags" else "w") as stream:
+        write(stream, tags, basedir)
+    os.rename(tmp, output)
+    return stats
+
+# ====== #
+# Engine #
+# ====== #
+
+ENGINES = ("import", "static", "bytecode")
+DEFAULT_ENGINE = "import"
+
+class Locator(object):
+    """Locate objects, re-using what was found for the previous targets.
+
+    A locator owns all the caches: imported modules, objects reached by
+    attribute chains, parsed and compiled files and source file names. Each
+    of them is bounded and evicts the least recently used entries first:
+    parsed and compiled files are limited to *parse_cache_size* entries
+    each, live objects located by locate_object() to *object_cache_size*
+    entries and the others to *cache_size* entries. A single instance can
+    be shared by many threads.
+
+    *engine* and *index* are used by locate() as described in pyloc().
+    """
+
+    def __init__(self, engine=DEFAULT_ENGINE, index=None,
+                 parse_cache_size=DEFAULT_PARSE_CACHE_SIZE,
+                 cache_size=DEFAULT_CACHE_SIZE,
+                 object_cache_size=DEFAULT_OBJECT_CACHE_SIZE):
+        if engine not in ENGINES:
+            raise ValueError("unsupported engine: {}".format(engine))
+        self.engine = engine
+        self.index = index
+        self._tables = _LRUCache(parse_cache_size)
+        self._codes = _LRUCache(parse_cache_size)
+        self._modules = _LRUCache(cache_size)
+        self._attrs = _LRUCache(cache_size)
+        self._files = _LRUCache(cache_size)
+        self._objects = _LRUCache(object_cache_size)
+        self._spans = _LRUCache(parse_cache_size)
+
+    def cache_info(self):
+        """Return hits, misses, maximum and current size of the parse
+        cache."""
+        return self._tables.info()
+
+    def clear_cache(self):
+        """Drop everything cached and reset the cache counters."""
+        for cache in (self._tables, self._codes, self._modules, self._attrs,
+                      self._files, self._objects, self._spans):
+            cache.clear()
+        _clear_module_probes()
+
+    def invalidate(self, filename):
+        """Forget everything cached about *filename*.
+
+        Modules imported from it are forgotten too, but they are imported
+        again only once removed from sys.modules.
+        """
+        path = os.path.realpath(filename)
+        def is_file(name):
+            return name is not None and os.path.realpath(name) == path
+        self._tables.remove_if(lambda key, _: key[0] == path)
+        self._spans.remove_if(lambda key, _: key[0] == path)
+        self._codes.remove_if(
+            lambda key, _: key[0][0] == path
+            or (key[1] is not None and key[1][0] == path))
+        self._files.remove_if(lambda _, found: is_file(found))
+        self._modules.remove_if(
+            lambda _, module: is_file(getattr(module, "__file__", None)))
+        self._attrs.remove_if(
+            lambda _, value: is_file(getattr(value[0], "__file__", None)))
+        self._objects.remove_if(
+            lambda _, value: any(is_file(loc.filename) for loc in value[1]))
+        # The file may have been added: a module may be found where none
+        # was before.
+        _clear_module_probes()
 
-def _get_node_name(node):
-    if hasattr(node, "name"):
-        if hasattr(node, "asname") and node.asname:
-            return node.asname
-        return node.name
-    elif hasattr(node, "id"):
-        return node.id
-    else:
-        raise ValueError("do not know how to get name of node: {!r}"
-                         .format(node))
+    def locate(self, target, timings=None):
+        """Return possible locations defining *target* (see pyloc())."""
+        return self._locate(target, self.engine, self.index, timings)
 
-def _iter_assigned_names(node):
-    assert isinstance(node, ast.Assign)
-    for target in node.targets:
-        for n in ast.walk(target):
-            if isinstance(n, ast.Name):
-                yield n
+    def locate_many(self, targets):
+        """Return the list of the locations of each of *targets*.
 
-class _AssignVisitor(ast.NodeVisitor):
+        Stop at the first target that cannot be located.
+        """
+        return [self.locate(target) for target in targets]
 
-    def __init__(self, qualname):
-        self.qualname = qualname
-        self.candidates = []
-        self.path = []
+    def locate_object(self, obj):
+        """Return possible locations defining the live object *obj*.
 
-    def visit_ClassDef(self, node):
-        self.path.append(node)
-        retval = self.generic_visit(node)
-        self.path.pop()
-        return retval
+        *obj* is a module, a class, a function, a method, a code object, a
+        frame or a traceback. Nothing is imported and the result is
+        memoized per code object or class.
+        """
+        obj = _get_locatable(obj)
+        key = id(obj)
+        cached = self._objects.get(key)
+        # Ids are re-used once objects are garbage collected.
+        if cached is not None and cached[0] is obj:
+            return list(cached[1])
+        if inspect.ismodule(obj):
+            qualname = None
+        else:
+            qualname = getattr(obj, "__qualname__", None) \
+                or getattr(obj, "co_qualname", None) \
+                or getattr(obj, "__name__", None) \
+                or obj.co_name
+        locs = self._get_locations(obj, qualname)
+        self._objects.put(key, (obj, locs))
+        return list(locs)
 
-    def visit_Assign(self, node):
-        for name_node in _iter_assigned_names(node):
-            qualname = ".".join(_get_node_name(n)
-                                for n in self.path+[name_node])
-            if qualname == self.qualname:
-                self.candidates.append(node)
+    def locate_objects(self, objs):
+        """Return the list of the locations of each of *objs*."""
+        return [self.locate_object(obj) for obj in objs]
 
-    def visit_ImportFrom(self, node):
-        for name_node in node.names:
-            qualname = ".".join(_get_node_name(n)
-                                for n in self.path+[name_node])
-            if qualname == self.qualname:
-                self.candidates.append(node)
+    def complete(self, prefix):
+        """Return the sorted names "module[:qualname]" starting with
+        *prefix*, up to the next "." or ":" that follows it.
 
-    def visit_FunctionDef(self, node):
-        # Do not descend into FunctionDef
-        pass
+        The index is used if it exists. Otherwise only the modules of the
+        package (or the symbols of the module) named by *prefix* are
+        listed, without importing anything.
+        """
+        if self.index is not None and os.path.exists(self.index):
+            return _get_index(self.index).complete(prefix)
+        modname, sep, _ = prefix.partition(":")
+        if sep:
+            source = _get_spec_source(_find_spec(modname))
+            if source is None:
+                return []
+            try:
+                table = _get_symbol_table(source, self._tables)
+            except (SyntaxError, ValueError, UnicodeDecodeError, IOError):
+                return []
+            names = set(modname + ":" + qualname
+                        for qualname, _, _, _, _ in _iter_definitions(table))
+        else:
+            import pkgutil
+            parent, dot, _ = prefix.rpartition(".")
+            if parent:
+                spec = _find_spec(parent)
+                if spec is None or spec.submodule_search_locations is None:
+                    return []
+                search_path = list(spec.submodule_search_locations)
+            else:
+                search_path = None
+            names = set(parent + dot + name for _, name, _ in
+                        pkgutil.iter_modules(search_path))
+            if not parent:
+                names.update(sys.builtin_module_names)
+        return _NameTrie(sorted(names)).complete(prefix)
 
-def _search_assign(filename, qualname):
-    source = _get_file_content(filename)
-    root_node = ast.parse(source, filename)
-    visitor = _AssignVisitor(qualname)
-    visitor.visit(root_node)
-    return visitor.candidates
+    def qualname_at(self, filename, line):
+        """Return the qualified name of the innermost class or function of
+        *filename* enclosing *line*, or None if it is at module level."""
+        return self.qualnames_at(filename, [line])[0]
 
-def _is_inspectable(obj):
-    return inspect.isclass(obj) \
-        or inspect.ismethod(obj) \
-        or inspect.isfunction(obj) \
-        or inspect.ismodule(obj)
+    def qualnames_at(self, filename, lines):
+        """Return the list of the qualified names enclosing each of *lines*
+        of *filename* (see qualname_at()).
 
-def _find_frozen_file(obj, qualname, filename):
-    mo = re.match(r"^<frozen (.*)>$", filename)
-    if mo:
+        The file is parsed once and each line costs a bisection.
+        """
+        key = _get_file_key(filename)
+        spans = self._spans.get(key)
+        if spans is None:
+            spans = _SpanIndex(_get_symbol_table(filename, self._tables))
+            self._spans.put(key, spans)
+        return [spans.find(line) for line in lines]
+
+    def search(self, name):
+        """Return the definitions of the bare *name* in all the modules of
+        the index (see Index.search()).
+
+        Raise PylocError if there is no index.
+        """
+        if self.index is None or not os.path.exists(self.index):
+            raise PylocError("cannot search '{}' without an index"
+                             .format(name))
+        return _get_index(self.index).search(name)
+
+    def _locate(self, target, engine, index, timings=None):
+        if timings is None:
+            return self._locate_untimed(target, engine, index)
+        saved = getattr(_TIMINGS, "current", None)
+        _TIMINGS.current = timings
         try:
-            mod = importlib.import_module(mo.group(1))
-        except ImportError:
-            pass
-        else:
-            filename = mod.__file__
-    return filename
+            with _timed("total"):
+                return self._locate_untimed(target, engine, index)
+        finally:
+            _TIMINGS.current = saved
 
-def _find_file_harder(obj, qualname, filename):
-    strategies = (_find_frozen_file,)
-    i = 0
-    while True:
-        if os.path.exists(filename):
-            return filename
-        if i >= len(strategies):
-            raise RuntimeError("failed to get an existing source file name")
-        strategy = strategies[i]
-        filename = strategy(obj, qualname, filename)
-        i += 1
+    def _locate_untimed(self, target, engine, index):
+        if not target:
+            raise ValueError("target must be a non-empty string")
+        if engine not in ENGINES:
+            raise ValueError("unsupported engine: {}".format(engine))
+        if index is not None:
+            with _timed("index"):
+                locs = _get_index(index).lookup(target)
+            if locs is not None:
+                return locs
+        if engine == "bytecode":
+            locs = _bytecode_locate(target, self._codes)
+            if locs is not None:
+                return locs
+        if engine in ("static", "bytecode"):
+            locs = _static_locate(target, self._tables)
+            if locs is not None:
+                return locs
+        return self._import_locate(target)
+
+    def _import_module(self, name):
+        module = self._modules.get(name)
+        # Modules may have been removed from sys.modules or reloaded since.
+        if module is None or sys.modules.get(name) is not module:
+            _emit("import_start", name)
+            try:
+                with _timed("import", name, "import_end"):
+                    module = importlib.import_module(name)
+            except ImportError as exc:
+                raise ModuleNameError(name, exc)
+            self._modules.put(name, module)
+        return module
+
+    def _get_attrs(self, module, attrs):
+        """Return the objects found following *attrs* from *module*."""
+        key = (module.__name__, tuple(attrs))
+        cached = self._attrs.get(key)
+        if cached is not None and cached[0] is module:
+            return cached[1]
+        objs = self._get_attrs(module, attrs[:-1]) if len(attrs) > 1 else ()
+        parent = objs[-1] if objs else module
+        try:
+            obj = getattr(parent, attrs[-1])
+        except AttributeError:
+            raise AttributeNameError(".".join([module.__name__]+attrs[:-1]),
+                                     attrs[-1])
+        objs = objs + (getattr(obj, "__wrapped__", obj),)
+        self._attrs.put(key, (module, objs))
+        return objs
+
+    def _find_file(self, obj, qualname, filename):
+        found = self._files.get(filename)
+        if found is None or not _source_exists(found):
+            with _timed("find_file"):
+                found = _find_file_harder(obj, qualname, filename)
+            self._files.put(filename, found)
+        return found
+
+    def _get_locations(self, obj, qualname):
+        with _timed("getsourcefile"):
+            filename = inspect.getsourcefile(obj)
+        if not filename:
+            return [Location(inspect.getfile(obj), None, None)]
+        if not os.path.exists(filename):
+            compiled = _get_sourceless_file(obj)
+            if compiled is not None:
+                return self._get_sourceless_locations(obj, qualname,
+                                                      compiled)
+        filename = self._find_file(obj, qualname, filename)
+        if inspect.ismodule(obj):
+            return [Location(filename, None, None)]
+        if inspect.isclass(obj):
+            ### Search for ClassDef node in AST.
+            candidates = _search_classdef(filename, qualname, self._tables)
+            if candidates:
+                if len(candidates) > 1:
+                    # Try to disambiguite by locating the method defined in
+                    # the class.
+                    with _timed("disamb", filename, "disamb"):
+                        candidate = _disamb_class_loc(candidates, obj)
+                    if candidate is not None:
+                        return [Location(filename,
+                                         candidate.lineno,
+                                         candidate.col_offset)]
+                return _candidate_nodes_to_locations(filename, candidates)
+            ### Search for Assign node in AST
+            candidates = _search_assign(filename, qualname, self._tables)
+            if candidates:
+                return _candidate_nodes_to_locations(filename, candidates)
+            return [Location(filename, None, None)]
+        return [Location(filename, _get_line(obj), None)]
 
-def _get_locations(obj, qualname):
-    filename = inspect.getsourcefile(obj)
-    if not filename:
-        return [Location(inspect.getfile(obj), None, None)]
-    filename = _find_file_harder(obj, qualname, filename)
-    if inspect.ismodule(obj):
+    def _get_sourceless_locations(self, obj, qualname, filename):
+        if inspect.ismodule(obj):
+            return [Location(filename, None, None)]
+        if not inspect.isclass(obj):
+            return [Location(filename, _get_line(obj), None)]
+        # Class lines can still be found in the compiled module.
+        code = _get_module_code(filename, None, self._codes)
+        if code is not None:
+            locs = _bytecode_locate_code(filename, code, qualname.split("."))
+            if locs is not None:
+                return locs
         return [Location(filename, None, None)]
-    if inspect.isclass(obj):
-        ### Search for ClassDef node in AST.
-        candidates = _search_classdef(filename, qualname)
-        if candidates:
-            if len(candidates) > 1:
-                # Try to disambiguite by locating the method defined in the
-                # class.
-                candidate = _disamb_class_loc(candidates, obj)
-                if candidate is not None:
-                    return [Location(filename,
-                                     candidate.lineno,
-                                     candidate.col_offset)]
-            return _candidate_nodes_to_locations(filename, candidates)
-        ### Search for Assign node in AST
-        candidates = _search_assign(filename, qualname)
+
+    def _import_locate(self, target):
+        if ":" not in target:
+            target = _from_pydoc_format(target)
+        mod_name, has_qualname, qualname = target.partition(":")
+        ### Try to import the module containing the given target.
+        module = self._import_module(mod_name)
+        ### Get location of module
+        if not has_qualname:
+            return self._get_locations(module, None)
+        ### Get the object in module
+        attrs = qualname.split(".")
+        objs = self._get_attrs(module, attrs)
+        obj = objs[-1]
+        last_inspectable_obj = module
+        last_inspectable_idx = 0
+        for i, o in enumerate(objs):
+            if _is_inspectable(o):
+                last_inspectable_obj = o
+                last_inspectable_idx = i
+        last_inspectable_obj_qualname = \
+            ".".join(attrs[:last_inspectable_idx+1])
+        ### Get location
+        last_inspectable_locs = self._get_locations(
+            last_inspectable_obj, last_inspectable_obj_qualname)
+        if last_inspectable_obj == obj:
+            return last_inspectable_locs
+        ### Further investigate location of non-inspect-able object.
+        assert _has_same_filename(last_inspectable_locs)
+        filename = last_inspectable_locs[0].filename
+        candidates = _search_assign(filename, qualname, self._tables)
         if candidates:
             return _candidate_nodes_to_locations(filename, candidates)
         return [Location(filename, None, None)]
-    return [Location(filename, _get_line(obj), None)]
 
-def _has_same_filename(locs):
-    filename = locs[0].filename
-    return all(map(lambda x: x.filename == filename, locs))
+_DEFAULT_LOCATOR = Locator()
 
-def _from_pydoc_format(target):
+def locate_object(obj):
+    """Return possible locations defining the live object *obj*.
+
+    See Locator.locate_object(). The caches of the default Locator instance
+    are used.
     """
-    The pydoc target format has no column to separate the package/module part
-    from the object part.
+    return _DEFAULT_LOCATOR.locate_object(obj)
+
+def locate_objects(objs):
+    """Return the list of the locations of each of the live *objs*."""
+    return _DEFAULT_LOCATOR.locate_objects(objs)
+
+def complete(prefix, index=None):
+    """Return the names completing *prefix* (see Locator.complete()).
+
+    ``index`` is the path of an index built by build_index().
     """
-    parts = target.split(".")
-    nparts = len(parts)
-    if nparts <= 1:
-        return target
-    for i in range(nparts, 0, -1):
-        mod_part = ".".join(parts[:i])
-        try:
-            importlib.import_module(mod_part)
-        except ImportError:
-            pass
-        else:
-            qual_part = ".".join(parts[i:])
-            if qual_part:
-                return mod_part + ':' + qual_part
-            return mod_part
-    # We cannot import the target at all. Return it as is. The rest of the
-    # program will report the error.
-    return target
+    if index is None:
+        return _DEFAULT_LOCATOR.complete(prefix)
+    return Locator(index=index).complete(prefix)
+
+def qualname_at(filename, line):
+    """Return the qualified name of the innermost class or function of
+    *filename* enclosing *line*, or None if it is at module level.
+
+    See Locator.qualname_at(). The caches of the default Locator instance
+    are used.
+    """
+    return _DEFAULT_LOCATOR.qualname_at(filename, line)
+
+def search(name, index=None):
+    """Return the definitions of the bare *name* in all the modules of the
+    index stored at *index* (default to the one of build_index()).
 
-def pyloc(target):
+    See Index.search().
+    """
+    if index is None:
+        index = _default_index_path()
+    return Locator(index=index).search(name)
+
+def pyloc(target, engine=DEFAULT_ENGINE, index=None, timings=None):
     """Return possible location defining ``target`` object.
 
     ``target`` named "module[:qualname]".
@@ -288,53 +2642,456 @@ def pyloc(target):
     The line and column number may be None if no applicable (i.e. for module
     or package) or if they cannot be found.
 
+    ``engine`` is either "import" to import the module and inspect the
+    object or "static" to only read the module source code. The static
+    engine does not run any module code (except for targets it cannot
+    decide on, in which case it falls back to the import engine). The
+    "bytecode" engine locates classes and functions using the up-to-date
+    compiled module cached in __pycache__, without parsing its source code.
+    It falls back to the static engine otherwise.
+
+    ``index`` is the path of an index built by build_index(). If given, it is
+    looked up first and the engine is used only if it has no up-to-date
+    answer.
+
+    ``timings`` is a dictionary. If given, the nanoseconds spent in each
+    phase of the lookup (see PHASES) are added to it.
+
+    The caches of a default Locator instance are used.
+
     Inspired by 'inspect._main()' and 'inspect.findsource()' by
       Ka-Ping Yee <ping@lfw.org> and
       Yury Selivanov <yselivanov@sprymix.com>
     """
-    if not target:
-        raise ValueError("target must be a non-empty string")
-    if ":" not in target:
-        target = _from_pydoc_format(target)
-    mod_name, has_qualname, qualname = target.partition(":")
-    ### Try to import the module containing the given target.
+    return _DEFAULT_LOCATOR._locate(target, engine, index, timings)
+
+# ====== #
+# Server #
+# ====== #
+
+DEFAULT_SERVER_WORKERS = 4
+DEFAULT_IDLE_TIMEOUT = 600
+
+def _default_socket_path():
+    import tempfile
+    return os.path.join(
+        tempfile.gettempdir(),
+        "pyloc-{uid}-py{v.major}{v.minor}.sock"
+        .format(uid=os.getuid(), v=sys.version_info))
+
+@contextlib.contextmanager
+def _thread_pool(workers):
+    """Yield a function submitting calls to a pool of *workers* threads.
+
+    Submitted calls are all done on exit.
+    """
     try:
-        module = importlib.import_module(mod_name)
-    except ImportError as exc:
-        raise ModuleNameError(mod_name, exc)
-    ### Get location of module
-    if not has_qualname:
-        return _get_locations(module, None)
-    ### Get the object in module
-    attrs = qualname.split(".")
-    obj = module
-    last_inspectable_obj = obj
-    last_inspectable_idx = 0
-    for i in range(len(attrs)):
-        attr = attrs[i]
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError: # Python 2
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(workers)
         try:
-            obj = getattr(obj, attr)
-        except AttributeError:
-            raise AttributeNameError(".".join([module.__name__]+attrs[:i]),
-                                     attr)
+            yield lambda func, *args: pool.apply_async(func, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            yield pool.submit
+
+def _result_record(target, locs=None, error=None):
+    """Return a JSON serializable description of the location of *target*."""
+    record = {"target": target}
+    if error is None:
+        record["locations"] = [list(loc) for loc in locs]
+    else:
+        record["error"] = error
+    return record
+
+def _record_locations(record):
+    return [Location(*loc) for loc in record["locations"]]
+
+def _locate_record(locator, target, timings=None):
+    try:
+        locs = locator.locate(target, timings=timings)
+    except PylocError as e:
+        return _result_record(target, error=str(e))
+    except Exception as e:
+        # A target whose module fails to import must not bring the whole
+        # server down.
+        return _result_record(target,
+                              error="{}: {}".format(type(e).__name__, e))
+    return _result_record(target, locs=locs)
+
+class _Server(object):
+    """Answer location requests sent on a Unix domain socket.
+
+    Clients write one target per line and read back one JSON record per
+    target. Connections are served concurrently by a pool of worker
+    threads sharing the same locator. The server stops by itself once no
+    client has been seen for *idle_timeout* seconds (never if it is 0).
+    """
+
+    def __init__(self, path, workers=DEFAULT_SERVER_WORKERS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, engine=DEFAULT_ENGINE,
+                 index=None):
+        self.path = path
+        self.locator = Locator(engine=engine, index=index)
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._last_activity = time.time()
+        self._bound = None
+
+    def _touch(self, delta):
+        with self._lock:
+            self._active += delta
+            self._last_activity = time.time()
+
+    def _is_idle(self):
+        if not self.idle_timeout:
+            return False
+        with self._lock:
+            return self._active == 0 \
+                and time.time() - self._last_activity >= self.idle_timeout
+
+    def _bind(self):
+        import socket
+        import stat
+        try:
+            mode = os.lstat(self.path).st_mode
+        except OSError:
+            mode = None
+        if mode is not None:
+            if not stat.S_ISSOCK(mode):
+                raise PylocError("'{}' exists and is not a socket"
+                                 .format(self.path))
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                # Left over by a server that did not exit cleanly.
+                os.unlink(self.path)
+            else:
+                raise PylocError("a server is already listening on '{}'"
+                                 .format(self.path))
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        st = os.lstat(self.path)
+        self._bound = (st.st_dev, st.st_ino)
+        sock.listen(self.workers)
+        return sock
+
+    def _unlink(self):
+        # Only remove the socket this server created, not whatever may
+        # have replaced it since.
+        try:
+            st = os.lstat(self.path)
+        except OSError:
+            return
+        if (st.st_dev, st.st_ino) == self._bound:
+            os.unlink(self.path)
+
+    def serve(self):
+        import socket
+        sock = self._bind()
+        try:
+            if self.idle_timeout:
+                sock.settimeout(min(1.0, self.idle_timeout))
+            with _thread_pool(self.workers) as submit:
+                while not self._is_idle():
+                    try:
+                        conn, _ = sock.accept()
+                    except socket.timeout:
+                        continue
+                    conn.settimeout(None)
+                    self._touch(+1)
+                    submit(self._handle, conn)
+        finally:
+            sock.close()
+            self._unlink()
+
+    def _handle(self, conn):
+        import json
+        try:
+            rfile = conn.makefile("r")
+            wfile = conn.makefile("w")
+            for line in rfile:
+                target = line.strip()
+                if not target:
+                    continue
+                record = _locate_record(self.locator, target)
+                wfile.write(json.dumps(record))
+                wfile.write("\n")
+                wfile.flush()
+                self._touch(0)
+        except IOError:
+            pass # Client went away.
+        finally:
+            conn.close()
+            self._touch(-1)
+
+try:
+    _TEXT_TYPES = (str, unicode) # Python 2: JSON strings are unicode.
+except NameError:
+    _TEXT_TYPES = (str,)
+
+# JSON-RPC 2.0 error codes. REQUEST_CANCELLED comes from the Language
+# Server Protocol.
+_RPC_PARSE_ERROR = -32700
+_RPC_INVALID_REQUEST = -32600
+_RPC_METHOD_NOT_FOUND = -32601
+_RPC_INVALID_PARAMS = -32602
+_RPC_INTERNAL_ERROR = -32603
+_RPC_REQUEST_CANCELLED = -32800
+
+def _is_rpc_id(msgid):
+    """Tell whether *msgid* is a valid request id: a string, an integer or
+    None."""
+    import numbers
+    return msgid is None or isinstance(msgid, _TEXT_TYPES) \
+        or (isinstance(msgid, numbers.Integral)
+            and not isinstance(msgid, bool))
+
+class _RPCError(Exception):
+
+    def __init__(self, code, message):
+        super(_RPCError, self).__init__(message)
+        self.code = code
+
+def _unload_modules(filename):
+    """Remove the modules imported from *filename* from sys.modules."""
+    path = os.path.realpath(filename)
+    for name, module in list(sys.modules.items()):
+        modfile = getattr(module, "__file__", None)
+        if modfile and os.path.realpath(modfile) == path:
+            del sys.modules[name]
+
+class _StdioServer(object):
+    """Answer JSON-RPC 2.0 requests read on *rfile* and write the responses
+    on *wfile* (both binary streams).
+
+    Messages are framed by a Content-Length header as in the Language
+    Server Protocol. Requests are served concurrently by a pool of worker
+    threads sharing the same locator, so that responses may come out of
+    order. The methods are:
+
+    - locate(target): the JSON record of *target* (see "-f json");
+    - locateMany(targets): the list of the records of *targets*;
+    - invalidate(file): forget what was cached or imported from *file*,
+      before serving the next requests;
+    - complete(prefix): the names completing *prefix* (see --complete);
+    - search(name): the records of the definitions of *name* (see
+      --search);
+    - shutdown(): wait for the pending requests and stop.
+
+    The "$/cancelRequest" notification cancels the request with the given
+    id if it has not been answered yet. It gets the REQUEST_CANCELLED
+    error instead.
+    """
+
+    _PARAMS = {
+        "locate": ("target",),
+        "locateMany": ("targets",),
+        "invalidate": ("file",),
+        "complete": ("prefix",),
+        "search": ("name",),
+    }
+
+    def __init__(self, rfile, wfile, workers=DEFAULT_SERVER_WORKERS,
+                 engine=DEFAULT_ENGINE, index=None):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.locator = Locator(engine=engine, index=index)
+        self.workers = workers
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._cancelled = set()
+
+    def serve(self):
+        shutdown_id = None
+        with _thread_pool(self.workers) as submit:
+            while True:
+                body = self._read_message()
+                if body is None:
+                    break
+                message = self._parse_message(body)
+                if message is None:
+                    continue
+                msgid = message.get("id")
+                method = message["method"]
+                params = message.get("params", {})
+                if method == "shutdown":
+                    shutdown_id = msgid
+                    break
+                if method == "$/cancelRequest":
+                    self._cancel(params)
+                elif method not in self._PARAMS:
+                    if msgid is not None:
+                        self._send_error(msgid, _RPC_METHOD_NOT_FOUND,
+                                         "method not found: {}".format(method))
+                else:
+                    with self._lock:
+                        self._pending.add(msgid)
+                    if method == "invalidate":
+                        # The requests read next must see the new content.
+                        self._run(msgid, method, params)
+                    else:
+                        submit(self._run, msgid, method, params)
+        if shutdown_id is not None:
+            self._send({"jsonrpc": "2.0", "id": shutdown_id, "result": None})
+
+    def _read_message(self):
+        """Return the body of the next message or None at end of input."""
+        length = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                if length is not None:
+                    break
+                continue
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                try:
+                    length = int(value)
+                except ValueError:
+                    raise PylocError("invalid Content-Length header: {!r}"
+                                     .format(line))
+        body = self.rfile.read(length)
+        if len(body) < length:
+            return None
+        return body
+
+    def _parse_message(self, body):
+        import json
+        try:
+            message = json.loads(body.decode("utf-8"))
+        except ValueError as e:
+            self._send_error(None, _RPC_PARSE_ERROR, str(e))
+            return None
+        if not isinstance(message, dict) \
+           or message.get("jsonrpc") != "2.0" \
+           or not isinstance(message.get("method"), _TEXT_TYPES) \
+           or not isinstance(message.get("params", {}), (dict, list)) \
+           or not _is_rpc_id(message.get("id")):
+            msgid = message.get("id") if isinstance(message, dict) else None
+            if not _is_rpc_id(msgid):
+                msgid = None
+            self._send_error(msgid, _RPC_INVALID_REQUEST, "invalid request")
+            return None
+        return message
+
+    def _send(self, message):
+        import json
+        body = json.dumps(message).encode("utf-8")
+        with self._write_lock:
+            self.wfile.write("Content-Length: {}\r\n\r\n"
+                             .format(len(body)).encode("ascii"))
+            self.wfile.write(body)
+            self.wfile.flush()
+
+    def _send_error(self, msgid, code, message):
+        self._send({"jsonrpc": "2.0", "id": msgid,
+                    "error": {"code": code, "message": message}})
+
+    def _cancel(self, params):
+        msgid = params.get("id") if isinstance(params, dict) else None
+        if msgid is None or not _is_rpc_id(msgid):
+            return
+        with self._lock:
+            # Ids already answered are not remembered.
+            if msgid in self._pending:
+                self._cancelled.add(msgid)
+
+    def _check_cancelled(self, msgid):
+        with self._lock:
+            if msgid in self._cancelled:
+                raise _RPCError(_RPC_REQUEST_CANCELLED, "request cancelled")
+
+    def _get_params(self, method, params):
+        names = self._PARAMS[method]
+        if isinstance(params, list):
+            if len(params) != len(names):
+                raise _RPCError(_RPC_INVALID_PARAMS,
+                                "{} expects {} parameters"
+                                .format(method, len(names)))
+            return params
+        try:
+            return [params[name] for name in names]
+        except KeyError as e:
+            raise _RPCError(_RPC_INVALID_PARAMS,
+                            "missing parameter: {}".format(e.args[0]))
+
+    def _run(self, msgid, method, params):
+        try:
+            self._check_cancelled(msgid)
+            result = getattr(self, "_do_" + method)(
+                msgid, *self._get_params(method, params))
+        except _RPCError as e:
+            response = {"code": e.code, "message": str(e)}
+        except Exception as e:
+            response = {"code": _RPC_INTERNAL_ERROR,
+                        "message": "{}: {}".format(type(e).__name__, e)}
         else:
-            obj = getattr(obj, "__wrapped__", obj)
-            if _is_inspectable(obj):
-                last_inspectable_obj = obj
-                last_inspectable_idx = i
-    last_inspectable_obj_qualname = ".".join(attrs[:last_inspectable_idx+1])
-    ### Get location
-    last_inspectable_locs = _get_locations(last_inspectable_obj,
-                                           last_inspectable_obj_qualname)
-    if last_inspectable_obj == obj:
-        return last_inspectable_locs
-    ### Further investigate location of non-inspect-able object.
-    assert _has_same_filename(last_inspectable_locs)
-    filename = last_inspectable_locs[0].filename
-    candidates = _search_assign(filename, qualname)
-    if candidates:
-        return _candidate_nodes_to_locations(filename, candidates)
-    return [Location(filename, None, None)]
+            response = None
+        finally:
+            with self._lock:
+                self._pending.discard(msgid)
+                self._cancelled.discard(msgid)
+        if msgid is None:
+            return # Notifications are not answered.
+        if response is None:
+            self._send({"jsonrpc": "2.0", "id": msgid, "result": result})
+        else:
+            self._send({"jsonrpc": "2.0", "id": msgid, "error": response})
+
+    def _check_target(self, target):
+        if not isinstance(target, _TEXT_TYPES):
+            raise _RPCError(_RPC_INVALID_PARAMS,
+                            "target must be a string: {!r}".format(target))
+        return target
+
+    def _do_locate(self, msgid, target):
+        return _json_record(_locate_record(self.locator,
+                                           self._check_target(target)))
+
+    def _do_locateMany(self, msgid, targets):
+        if not isinstance(targets, list):
+            raise _RPCError(_RPC_INVALID_PARAMS, "targets must be a list")
+        records = []
+        for target in targets:
+            self._check_cancelled(msgid)
+            records.append(self._do_locate(msgid, target))
+        return records
+
+    def _do_complete(self, msgid, prefix):
+        if not isinstance(prefix, _TEXT_TYPES):
+            raise _RPCError(_RPC_INVALID_PARAMS, "prefix must be a string")
+        return self.locator.complete(prefix)
+
+    def _do_search(self, msgid, name):
+        if not isinstance(name, _TEXT_TYPES):
+            raise _RPCError(_RPC_INVALID_PARAMS, "name must be a string")
+        try:
+            definitions = self.locator.search(name)
+        except PylocError as e:
+            raise _RPCError(_RPC_INTERNAL_ERROR, str(e))
+        return [_json_record(_definition_record(definition))
+                for definition in definitions]
+
+    def _do_invalidate(self, msgid, filename):
+        if not isinstance(filename, _TEXT_TYPES):
+            raise _RPCError(_RPC_INVALID_PARAMS, "file must be a string")
+        self.locator.invalidate(filename)
+        _unload_modules(filename)
+        return None
 
 # =============================== #
 # Command line interface function #
@@ -366,13 +3123,52 @@ def format_loc(loc, format=DEFAULT_LOC_FORMAT):
 _EPILOGUE = """
 environment variables:
  PYLOC_DEFAULT_FORMAT - default output format (default: {default_format})
+ PYLOC_SOCKET - socket of the server (default: {default_socket})
+ PYLOC_INDEX - symbol index file (default: {default_index})
 
 Copyright (c) 2015-2016, Nicolas Despres
 All right reserved.
 """.format(
     default_format=DEFAULT_LOC_FORMAT,
+    default_socket="$TMPDIR/pyloc-$UID-pyXY.sock",
+    default_index="$XDG_CACHE_HOME/pyloc/index-pyXY-<prefix hash>.sqlite",
     )
 
+# Completion of the object names of the pyloc commands, on top of the
+# default completion of file names.
+_COMPLETION_SCRIPTS = {
+    "bash": r"""
+_pyloc_complete() {
+    local cur="${COMP_LINE:0:COMP_POINT}"
+    cur="${cur##*[[:space:]]}"
+    case "$cur" in
+        -*) return 0 ;;
+    esac
+    local IFS=$'\n'
+    COMPREPLY=($("${COMP_WORDS[0]}" --complete "$cur" 2>/dev/null))
+    # Bash splits words on colons: only what follows the last one is
+    # replaced.
+    if [[ "$cur" == *:* && "$COMP_WORDBREAKS" == *:* ]]; then
+        local colon_prefix="${cur%"${cur##*:}"}"
+        local i=${#COMPREPLY[@]}
+        while (( i-- > 0 )); do
+            COMPREPLY[$i]="${COMPREPLY[$i]#"$colon_prefix"}"
+        done
+    fi
+}
+complete -o nospace -o default -F _pyloc_complete pyloc pyloc2 pyloc3
+""",
+    "zsh": r"""
+_pyloc_complete() {
+    [[ "$PREFIX" == -* ]] && return 1
+    local -a names
+    names=(${(f)"$("${words[1]}" --complete "$PREFIX" 2>/dev/null)"})
+    compadd -S '' -U -- $names
+}
+compdef _pyloc_complete pyloc pyloc2 pyloc3
+""",
+}
+
 def _build_cli():
 
     class LazyVersionAction(argparse.Action):
@@ -423,9 +3219,18 @@ def _build_cli():
     parser.add_argument(
         "-f", "--format",
         action="store",
-        choices=("emacs", "vi", "human"),
+        choices=("emacs", "vi", "human", "json", "ndjson"),
         default=os.environ.get("PYLOC_DEFAULT_FORMAT", DEFAULT_LOC_FORMAT),
         help="How to write object location")
+    parser.add_argument(
+        "-e", "--engine",
+        action="store",
+        choices=ENGINES,
+        default=DEFAULT_ENGINE,
+        help="Import the module, only read its source code (static) or "
+        "its cached compiled code (bytecode) to locate objects. The "
+        "bytecode engine falls back to static, which falls back to import "
+        "when it cannot decide")
     parser.add_argument(
         "-a", "--all",
         action="store_true",
@@ -435,9 +3240,121 @@ def _build_cli():
         action=LazyVersionAction,
         version=_version)
     parser.add_argument(
-        "object_name",
+        "--index",
+        action="store",
+        default=os.environ.get("PYLOC_INDEX"),
+        help="Symbol index answering queries before the engine, if it "
+        "exists")
+    parser.add_argument(
+        "--no-index",
+        action="store_true",
+        help="Do not use the symbol index")
+    parser.add_argument(
+        "--build-index",
+        action="store_true",
+        help="Create or refresh the symbol index of all the modules "
+        "importable from sys.path")
+    parser.add_argument(
+        "-j", "--jobs",
+        action="store",
+        type=int,
+        default=None,
+        help="Number of processes parsing files when building the index "
+        "or the tags (default to the number of CPUs)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep imported modules and parsed files in memory and answer "
+        "requests sent by --client on a Unix domain socket")
+    mode.add_argument(
+        "--client",
+        action="store_true",
+        help="Forward object names to a server started with --serve")
+    mode.add_argument(
+        "--stdio",
+        action="store_true",
+        help="Answer JSON-RPC requests (locate, locateMany, invalidate, "
+        "complete, search, shutdown) framed by Content-Length headers on "
+        "the standard input and output, e.g. for an editor")
+    parser.add_argument(
+        "--socket",
+        action="store",
+        default=os.environ.get("PYLOC_SOCKET"),
+        help="Path of the server socket")
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        default=DEFAULT_SERVER_WORKERS,
+        help="Number of requests the server serves concurrently")
+    parser.add_argument(
+        "--idle-timeout",
+        action="store",
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT,
+        help="Seconds without client after which the server stops "
+        "(0 to never stop)")
+    parser.add_argument(
+        "--tags",
+        action="store",
+        metavar="PACKAGE",
+        help="Write the tags of every definition of PACKAGE (a module, a "
+        "package or a directory) to the --output file. Only files changed "
+        "since the last run are parsed again")
+    parser.add_argument(
+        "--tags-format",
+        action="store",
+        choices=TAG_FORMATS,
+        default="ctags",
+        help="Format of the tags file: ctags (vi), etags (Emacs) or json "
+        "(one object per line)")
+    parser.add_argument(
+        "-o", "--output",
+        action="store",
+        help="Tags file (default to tags, TAGS or tags.json depending on "
+        "--tags-format)")
+    parser.add_argument(
+        "--at",
+        action="store_true",
+        help="Take FILE:LINE arguments instead of object names and print "
+        "the name of the class or function enclosing each of them")
+    parser.add_argument(
+        "--search",
+        action="store",
+        metavar="NAME",
+        help="Print the location of every class, function and assignment "
+        "named NAME in the index, shortest module path first")
+    parser.add_argument(
+        "--complete",
+        action="store",
+        metavar="PREFIX",
+        help="Print the names of the modules and objects starting with "
+        "PREFIX, up to the next '.' or ':', using the index if it exists")
+    parser.add_argument(
+        "--completion-script",
+        action="store",
+        choices=sorted(_COMPLETION_SCRIPTS),
+        help="Print the shell code completing object names using "
+        "--complete, e.g. eval \"$(pyloc --completion-script bash)\"")
+    parser.add_argument(
+        "--stdin",
+        action="store_true",
+        help="Read newline separated object names from the standard input "
+        "(after those given on the command line)")
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print the time spent in each phase of the lookup of each "
+        "object on the standard error output, and a summary when several "
+        "objects are located")
+    parser.add_argument(
+        "object_names",
         action="store",
-        help="A python object named: module[:qualname]")
+        nargs="*",
+        metavar="object_name",
+        help="A python object named: module[:qualname] (or a FILE:LINE "
+        "with --at)")
     return parser
 
 def _error(msg):
@@ -445,27 +3362,307 @@ def _error(msg):
     sys.stderr.write(msg)
     sys.stderr.write("\n")
 
-def _main():
-    cli = _build_cli()
-    options = cli.parse_args(sys.argv[1:])
+def _iter_targets(options):
+    for target in options.object_names:
+        yield target
+    if options.stdin:
+        # Unlike iterating over it, readline() does not read ahead on
+        # Python 2, so that each target is answered as soon as read.
+        for line in iter(sys.stdin.readline, ""):
+            target = line.strip()
+            if target:
+                yield target
+
+def _print_locs(locs, options):
+    if options.all:
+        locs_to_print = locs
+    else:
+        if len(locs) > 1:
+            assert _has_same_filename(locs)
+            locs_to_print = [locs[0]]
+        else:
+            locs_to_print = locs
+    for loc in locs_to_print:
+        sys.stdout.write(format_loc(loc, format=options.format))
+        sys.stdout.write("\n")
+
+def _json_record(record):
+    """Return the output of the result *record* in the JSON formats."""
+    locs = record.get("locations", [])
+    first = locs[0] if locs else (None, None, None)
+    return OrderedDict([
+        ("target", record["target"]),
+        ("filename", first[0]),
+        ("line", first[1]),
+        ("column", first[2]),
+        ("candidates", [OrderedDict(zip(Location._fields, loc))
+                        for loc in locs]),
+        ("error", record.get("error")),
+    ])
+
+class _RecordPrinter(object):
+    """Write result records on the standard output in the format selected
+    by *options*.
+
+    The "json" format writes a single array whose items are written as
+    they come. The "ndjson" format writes one object per line. Both carry
+    errors in the records rather than on the standard error output.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.count = 0
+
+    def print_record(self, record):
+        import json
+        if self.options.format == "json":
+            sys.stdout.write(",\n" if self.count else "[\n")
+            sys.stdout.write(json.dumps(_json_record(record)))
+        elif self.options.format == "ndjson":
+            sys.stdout.write(json.dumps(_json_record(record)))
+            sys.stdout.write("\n")
+        elif "error" in record:
+            _error(record["error"])
+        else:
+            _print_locs(_record_locations(record), options=self.options)
+        self.count += 1
+
+    def close(self):
+        if self.options.format == "json":
+            sys.stdout.write("\n]\n" if self.count else "[]\n")
+
+def _format_ns(ns):
+    return "{:.3f}ms".format(ns / 1e6)
+
+def _print_timings(target, timings):
+    phases = ", ".join("{} {}".format(phase, _format_ns(timings[phase]))
+                       for phase in PHASES
+                       if phase in timings and phase != "total")
+    _error("timings: {}: total {} ({})"
+           .format(target, _format_ns(timings.get("total", 0)), phases))
+
+def _percentile(values, percent):
+    """Return the *percent*-th percentile of the sorted *values* (nearest
+    rank method)."""
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[rank - 1]
+
+def _print_timings_summary(all_timings):
+    row = "{:<14}" + " {:>12}" * 5 + "\n"
+    sys.stderr.write(row.format("phase", "total", "p50", "p90", "p99", "max"))
+    for phase in PHASES:
+        if not any(phase in timings for timings in all_timings):
+            continue
+        values = sorted(timings.get(phase, 0) for timings in all_timings)
+        sys.stderr.write(row.format(
+            phase, _format_ns(sum(values)),
+            *[_format_ns(_percentile(values, p)) for p in (50, 90, 99, 100)]))
+    sys.stderr.write("{} objects\n".format(len(all_timings)))
+
+def _serve(options):
+    server = _Server(options.socket,
+                     workers=options.workers,
+                     idle_timeout=options.idle_timeout,
+                     engine=options.engine,
+                     index=options.index)
     try:
-        locs = pyloc(options.object_name)
+        server.serve()
     except PylocError as e:
         _error(str(e))
         return 1
-    else:
-        if options.all:
-            locs_to_print = locs
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def _serve_stdio(options):
+    # Anything printed by the imported modules must not corrupt the
+    # responses.
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    server = _StdioServer(getattr(sys.stdin, "buffer", sys.stdin),
+                          getattr(stdout, "buffer", stdout),
+                          workers=options.workers,
+                          engine=options.engine,
+                          index=options.index)
+    try:
+        server.serve()
+    except PylocError as e:
+        _error(str(e))
+        return 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout = stdout
+    return 0
+
+def _run_at(options):
+    rc = 0
+    positions = []
+    for position in _iter_targets(options):
+        filename, _, line = position.rpartition(":")
+        try:
+            positions.append((position, filename, int(line)))
+        except ValueError:
+            _error("invalid position (expected FILE:LINE): {}"
+                   .format(position))
+            rc = 1
+    # Lines are looked up in batch per file.
+    lines = OrderedDict()
+    for _, filename, line in positions:
+        lines.setdefault(filename, []).append(line)
+    locator = Locator()
+    results = {}
+    for filename, file_lines in lines.items():
+        try:
+            qualnames = locator.qualnames_at(filename, file_lines)
+        except (EnvironmentError, SyntaxError, ValueError) as e:
+            results[filename] = e
         else:
-            if len(locs) > 1:
-                assert _has_same_filename(locs)
-                locs_to_print = [locs[0]]
-            else:
-                locs_to_print = locs
-        for loc in locs_to_print:
-            sys.stdout.write(format_loc(loc, format=options.format))
-            sys.stdout.write("\n")
+            modname = _get_module_name(filename) or filename
+            results[filename] = dict(
+                (line, modname if qualname is None
+                 else modname + ":" + qualname)
+                for line, qualname in zip(file_lines, qualnames))
+    for position, filename, line in positions:
+        result = results[filename]
+        if isinstance(result, Exception):
+            _error("cannot read '{}' ({}: {})"
+                   .format(filename, type(result).__name__, result))
+            rc = 1
+        else:
+            print(result[line])
+    return rc
+
+def _definition_record(definition):
+    return _result_record(definition.target,
+                          locs=[Location(*definition[2:])])
+
+def _run_search(options):
+    try:
+        definitions = Locator(index=options.index).search(options.search)
+    except PylocError as e:
+        _error("{} (see --build-index)".format(e))
+        return 1
+    printer = _RecordPrinter(options)
+    for definition in definitions:
+        if options.format == "human":
+            sys.stdout.write("Target: {}\n".format(definition.target))
+        printer.print_record(_definition_record(definition))
+    printer.close()
+    return 0 if definitions else 1
+
+def _run_client(options):
+    import socket
+    import json
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(options.socket)
+    except socket.error as e:
+        _error("cannot connect to server on '{}' ({})"
+               .format(options.socket, e))
+        return 1
+    rc = 0
+    printer = _RecordPrinter(options)
+    try:
+        rfile = sock.makefile("r")
+        wfile = sock.makefile("w")
+        for target in _iter_targets(options):
+            wfile.write(target)
+            wfile.write("\n")
+            wfile.flush()
+            line = rfile.readline()
+            if not line:
+                _error("connection closed by server")
+                return 1
+            record = json.loads(line)
+            if "error" in record:
+                rc = 1
+            printer.print_record(record)
+            sys.stdout.flush()
+    finally:
+        sock.close()
+        printer.close()
+    return rc
+
+def _main():
+    cli = _build_cli()
+    options = cli.parse_args(sys.argv[1:])
+    if options.socket is None:
+        options.socket = _default_socket_path()
+    if options.index is None:
+        options.index = _default_index_path()
+    if options.build_index:
+        stats = build_index(options.index, jobs=options.jobs)
+        print("indexed {} files ({} parsed, {} removed) in {}"
+              .format(stats.files, stats.parsed, stats.removed,
+                      options.index))
+        if not options.object_names and not options.stdin:
+            return 0
+    if options.no_index or not os.path.exists(options.index):
+        options.index = None
+    if options.completion_script is not None:
+        sys.stdout.write(_COMPLETION_SCRIPTS[options.completion_script]
+                         .lstrip())
+        return 0
+    if options.tags is not None:
+        if options.object_names or options.stdin:
+            cli.error("--tags does not take object names")
+        try:
+            stats = build_tags(options.tags, options.output,
+                               format=options.tags_format, jobs=options.jobs)
+        except PylocError as e:
+            _error(str(e))
+            return 1
+        print("tagged {} files ({} parsed) of {}"
+              .format(stats.files, stats.parsed, options.tags))
+        return 0
+    if options.at:
+        if not options.object_names and not options.stdin:
+            cli.error("at least one FILE:LINE is required")
+        return _run_at(options)
+    if options.search is not None:
+        if options.object_names or options.stdin:
+            cli.error("--search does not take object names")
+        return _run_search(options)
+    if options.complete is not None:
+        if options.object_names or options.stdin:
+            cli.error("--complete does not take object names")
+        for name in Locator(index=options.index).complete(options.complete):
+            print(name)
         return 0
+    if options.serve:
+        if options.object_names or options.stdin:
+            cli.error("--serve does not take object names")
+        return _serve(options)
+    if options.stdio:
+        if options.object_names or options.stdin:
+            cli.error("--stdio does not take object names")
+        return _serve_stdio(options)
+    if not options.object_names and not options.stdin:
+        cli.error("at least one object name is required")
+    if options.client:
+        return _run_client(options)
+    rc = 0
+    # Modules imported and files parsed for one target are re-used by the
+    # next ones.
+    locator = Locator(engine=options.engine, index=options.index)
+    printer = _RecordPrinter(options)
+    all_timings = []
+    for target in _iter_targets(options):
+        timings = {} if options.timings else None
+        record = _locate_record(locator, target, timings=timings)
+        if "error" in record:
+            rc = 1
+        printer.print_record(record)
+        # Let consumers reading from a pipe get results as they come.
+        sys.stdout.flush()
+        if timings is not None:
+            _print_timings(target, timings)
+            all_timings.append(timings)
+    printer.close()
+    if len(all_timings) > 1:
+        _print_timings_summary(all_timings)
+    return rc
 
 if __name__ == "__main__":
     sys.exit(_main())
@@ -16,8 +16,21 @@ import tempfile
 import shutil
 
 from pyloc import pyloc
+from pyloc import Locator
+from pyloc import add_hook
+from pyloc import remove_hook
+from pyloc import stats
 from pyloc import ModuleNameError
 from pyloc import AttributeNameError
+from pyloc import cache_info
+from pyloc import clear_cache
+from pyloc import _LRUCache
+from pyloc import _build_symbol_table
+import pyloc as pyloc_module
+from pyloc import Index
+from pyloc import build_index
+from pyloc import _MappedIndex
+from pyloc import _get_file_key
 
 # Guidelines:
 # - Generate the package/module fixture for testing.
@@ -101,7 +114,10 @@ class CompatAssert(object):
             msg = '%s: %r not found in %r' % (msg, expected_regex.pattern, text)
             raise self.failureException(msg)
 
-class TestPyloc(unittest.TestCase, CompatAssert):
+class PylocTestCase(unittest.TestCase, CompatAssert):
+    """Base class of test case locating objects in generated fixtures."""
+
+    ENGINE = "import"
 
     def assertLocEqual(self, rootdir, expected, modname, qualname=None,
                        locs=None, sep=":"):
@@ -119,7 +135,7 @@ class TestPyloc(unittest.TestCase, CompatAssert):
         elif isinstance(locs, int):
             locs = [(locs, None)]
         with save_sys_modules():
-            actuals = pyloc(fullname)
+            actuals = pyloc(fullname, engine=self.ENGINE)
         self.assertEqual(len(locs), len(actuals))
         for actual, loc in zip(actuals, locs):
             self.assertEqual(expected, actual.filename)
@@ -134,6 +150,8 @@ class TestPyloc(unittest.TestCase, CompatAssert):
             gen_fixture_in(spec, tmpdir)
             yield FixtureCtxt(self, tmpdir)
 
+class TestPyloc(PylocTestCase):
+
     def test_module_name_error(self):
         with self.assertRaises(ModuleNameError):
             pyloc("list")
@@ -424,7 +442,7 @@ class TestPyloc(unittest.TestCase, CompatAssert):
                                  locs=(1, 0))
 
     def test_multiple_classes(self):
-        for cond in (True, False):
+        for cond, loc in ((True, (3, 4)), (False, (6, 4))):
             modcontent = textwrap.dedent(
                 """\
                 cond = {cond}
@@ -437,9 +455,13 @@ class TestPyloc(unittest.TestCase, CompatAssert):
                 """.format(cond=cond))
             spec = {"pyloc_testmod":modcontent}
             with self.fixture(spec) as fctxt:
+                # Since 3.13, classes know the line they start at.
+                if PY_VERSION >= (3, 13, 0):
+                    locs = loc
+                else:
+                    locs = [(3, 4), (6, 4)]
                 fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
-                                     qualname="C",
-                                     locs=[(3, 4), (6, 4)])
+                                     qualname="C", locs=locs)
 
     def test_multiple_classes_disamb(self):
         for cond, loc in ((True, (3, 4)), (False, (7, 4))):
@@ -461,6 +483,46 @@ class TestPyloc(unittest.TestCase, CompatAssert):
                                      qualname="C",
                                      locs=loc)
 
+    def test_multiple_classes_disamb_own_methods(self):
+        for cond, loc, old_loc in ((True, (9, 4), (19, 4)),
+                                   (False, (14, 4), (23, 4))):
+            modcontent = textwrap.dedent(
+                """\
+                class Boom(object):
+                    def __get__(self, obj, objtype=None):
+                        raise RuntimeError("descriptor must not be called")
+                class Base(object):
+                    def m(self):
+                        pass
+                cond = {cond}
+                if cond:
+                    class C(Base):
+                        boom = Boom()
+                        def n(self):
+                            pass
+                else:
+                    class C(Base):
+                        boom = Boom()
+                        def n(self):
+                            pass
+                if cond:
+                    class Old: # Python 2: old-style class.
+                        def n(self):
+                            pass
+                else:
+                    class Old:
+                        def n(self):
+                            pass
+                """.format(cond=cond))
+            spec = {"pyloc_testmod":modcontent}
+            with self.fixture(spec) as fctxt:
+                fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                     qualname="C",
+                                     locs=loc)
+                fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                     qualname="Old",
+                                     locs=old_loc)
+
     def test_class_robust_comment(self):
         modcontent = textwrap.dedent(
             """\
@@ -851,6 +913,964 @@ class TestPyloc(unittest.TestCase, CompatAssert):
                                  qualname="C.func", locs=2,
                                  sep=".")
 
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_dot_probes_are_memoized(self):
+        spec = {"pyloc_testpkg":{"mod1":"class C:\n    def func(): pass\n"}}
+        with self.fixture(spec) as fctxt:
+            fctxt.assertLocEqual("pyloc_testpkg/mod1.py",
+                                 "pyloc_testpkg.mod1",
+                                 qualname="C.func", locs=2,
+                                 sep=".")
+            probes = pyloc_module._MODULE_PROBES
+            self.assertIs(probes.get("pyloc_testpkg.mod1.C"), False)
+            self.assertNotIn("pyloc_testpkg.mod1.C.func", probes)
+
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_dot_probes_are_cleared(self):
+        spec = {"pyloc_testpkg":{"mod1":"class C: pass\n"}}
+        with self.fixture(spec) as fctxt, save_sys_modules():
+            locator = Locator(engine=self.ENGINE)
+            with self.assertRaises((ModuleNameError, AttributeNameError)):
+                locator.locate("pyloc_testpkg.newmod.C")
+            newmod = os.path.join(fctxt.tmpdir, "pyloc_testpkg", "newmod.py")
+            with open(newmod, "w") as f:
+                f.write("\nclass C: pass\n")
+            locator.invalidate(newmod)
+            locator.clear_cache()
+            locs = locator.locate("pyloc_testpkg.newmod.C")
+            self.assertEqual([(newmod, 2)],
+                             [(loc.filename, loc.line) for loc in locs])
+
+class TestPylocStatic(TestPyloc):
+    """Run all the tests again with the static engine.
+
+    It must find the same locations, either by itself or by falling back
+    to the import engine.
+    """
+
+    ENGINE = "static"
+
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_follow_imported_class_as(self):
+        spec = {
+            "pyloc_testpkg": {
+                "mod1": textwrap.dedent(
+                    """\
+                    class RealC(object):
+                        pass
+                    """),
+                "mod2": textwrap.dedent(
+                    """\
+                    from pyloc_testpkg.mod1 import RealC as C
+                    """),
+            },
+        }
+        with self.fixture(spec) as fctxt:
+            # Better than the import engine since the import is followed.
+            fctxt.assertLocEqual("pyloc_testpkg/mod1.py", "pyloc_testpkg.mod2",
+                                 qualname="C",
+                                 locs=(1, 0))
+
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_does_not_import(self):
+        spec = {
+            "pyloc_testpkg": {
+                "__init__": "raise RuntimeError('must not be imported')\n",
+                "mod": textwrap.dedent(
+                    """\
+                    raise RuntimeError("must not be imported")
+                    from os.path import join as j
+                    @decorator
+                    def f():
+                        pass
+                    class C(object):
+                        class D(object):
+                            @property
+                            def p(self):
+                                pass
+                    """),
+            },
+        }
+        with self.fixture(spec) as fctxt:
+            fctxt.assertLocEqual("pyloc_testpkg/mod.py", "pyloc_testpkg.mod")
+            fctxt.assertLocEqual("pyloc_testpkg/mod.py", "pyloc_testpkg.mod",
+                                 qualname="f", locs=3)
+            fctxt.assertLocEqual("pyloc_testpkg/mod.py", "pyloc_testpkg.mod",
+                                 qualname="C.D", locs=(7, 4))
+            fctxt.assertLocEqual("pyloc_testpkg/mod.py", "pyloc_testpkg.mod",
+                                 qualname="C.D.p", locs=8, sep=".")
+            import posixpath
+            self.assertLocEqual(None, posixpath.__file__,
+                                "pyloc_testpkg.mod", qualname="j",
+                                locs=[(posixpath.join.__code__.co_firstlineno,
+                                       None)])
+            self.assertNotIn("pyloc_testpkg", sys.modules)
+
+    def test_fall_back_when_redefined(self):
+        modcontent = textwrap.dedent(
+            """\
+            def f():
+                pass
+            f = 42
+            """)
+        with self.fixture({"pyloc_testmod":modcontent}) as fctxt:
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="f", locs=(3, 0))
+
+class TestIndex(PylocTestCase):
+
+    SPEC = {
+        "pyloc_testpkg": {
+            "mod": textwrap.dedent(
+                """\
+                class C(object):
+                    @staticmethod
+                    def f():
+                        pass
+                    PI = 3.14
+                if True:
+                    def g():
+                        pass
+                else:
+                    def g():
+                        pass
+                """),
+        },
+    }
+
+    @contextlib.contextmanager
+    def index_fixture(self, spec):
+        with self.fixture(spec) as fctxt:
+            index_path = os.path.join(fctxt.tmpdir, "index.sqlite")
+            stats = build_index(index_path, search_path=[fctxt.tmpdir])
+            self.assertEqual((2, 2, 0), tuple(stats))
+            yield fctxt, Index(index_path)
+
+    def test_lookup(self):
+        with self.index_fixture(self.SPEC) as (fctxt, index):
+            modpath = os.path.join(fctxt.tmpdir, "pyloc_testpkg", "mod.py")
+            self.assertEqual([(modpath, None, None)],
+                             index.lookup("pyloc_testpkg.mod"))
+            self.assertEqual([(modpath, 1, 0)],
+                             index.lookup("pyloc_testpkg.mod:C"))
+            self.assertEqual([(modpath, 2, None)],
+                             index.lookup("pyloc_testpkg.mod.C.f"))
+            # Assignments and ambiguous definitions are left to the engine.
+            self.assertIsNone(index.lookup("pyloc_testpkg.mod:C.PI"))
+            self.assertIsNone(index.lookup("pyloc_testpkg.mod:g"))
+            self.assertIsNone(index.lookup("pyloc_testpkg.mod:h"))
+            self.assertIsNone(index.lookup("doesnotexist"))
+
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_shadowed(self):
+        spec = {"pyloc_testmod": "\n\nclass K(object): pass\n"}
+        with self.fixture(spec) as fctxt:
+            # Indexed from another directory than the one imported from.
+            otherdir = os.path.join(fctxt.tmpdir, "other")
+            os.mkdir(otherdir)
+            gen_fixture_in({"pyloc_testmod": "class K(object): pass\n"},
+                           otherdir)
+            index_path = os.path.join(fctxt.tmpdir, "index.sqlite")
+            build_index(index_path, search_path=[otherdir])
+            index = Index(index_path)
+            self.assertIsNone(index.lookup("pyloc_testmod:K"))
+            modpath = os.path.join(fctxt.tmpdir, "pyloc_testmod.py")
+            self.assertEqual([(modpath, 3, 0)],
+                             pyloc("pyloc_testmod:K", index=index_path))
+
+    def test_default_path(self):
+        with self.fixture({"pyloc_testmod": ""}) as fctxt:
+            saved_path = sys.path[:]
+            try:
+                # The script (or current) directory is not indexed.
+                sys.path[:] = [fctxt.tmpdir, ""] + [
+                    entry for entry in saved_path
+                    if entry and entry != fctxt.tmpdir
+                    and os.path.abspath(entry) != os.getcwd()]
+                self.assertEqual([], [
+                    m for m in pyloc_module._iter_path_modules()
+                    if m[1].startswith(fctxt.tmpdir + os.sep)])
+            finally:
+                sys.path[:] = saved_path
+
+    def test_pyloc_does_not_import(self):
+        with self.index_fixture(self.SPEC) as (fctxt, index):
+            modpath = os.path.join(fctxt.tmpdir, "pyloc_testpkg", "mod.py")
+            self.assertEqual([(modpath, 2, None)],
+                             pyloc("pyloc_testpkg.mod:C.f", index=index.path))
+            self.assertNotIn("pyloc_testpkg.mod", sys.modules)
+
+    def test_refresh(self):
+        with self.index_fixture(self.SPEC) as (fctxt, index):
+            modpath = os.path.join(fctxt.tmpdir, "pyloc_testpkg", "mod.py")
+            with open(modpath, "a") as stream:
+                stream.write("def h(): pass\n")
+            # Out-dated file are not answered.
+            self.assertIsNone(index.lookup("pyloc_testpkg.mod:C"))
+            stats = index.refresh([fctxt.tmpdir])
+            self.assertEqual((2, 1, 0), tuple(stats))
+            self.assertEqual([(modpath, 1, 0)],
+                             index.lookup("pyloc_testpkg.mod:C"))
+            self.assertEqual([(modpath, 12, None)],
+                             index.lookup("pyloc_testpkg.mod:h"))
+            os.unlink(modpath)
+            stats = index.refresh([fctxt.tmpdir])
+            self.assertEqual((1, 0, 1), tuple(stats))
+            self.assertIsNone(index.lookup("pyloc_testpkg.mod:h"))
+
+    def test_search(self):
+        spec = {
+            "pyloc_testpkg": {
+                "mod": "class C(object):\n    def f(self): pass\n",
+                "sub": {
+                    "mod": "import os as f\nf = 1\n",
+                },
+            },
+            "pyloc_testmod": "def f(): pass\nclass D(object):\n    f = 2\n",
+        }
+        with self.fixture(spec) as fctxt:
+            index_path = os.path.join(fctxt.tmpdir, "index.sqlite")
+            build_index(index_path, search_path=[fctxt.tmpdir])
+            index = Index(index_path)
+            def path(*parts):
+                return os.path.join(fctxt.tmpdir, *parts)
+            # Shortest module path first, imports are not definitions.
+            self.assertEqual([
+                ("pyloc_testmod:f", "function", path("pyloc_testmod.py"),
+                 1, None),
+                ("pyloc_testmod:D.f", "assign", path("pyloc_testmod.py"),
+                 3, 4),
+                ("pyloc_testpkg.mod:C.f", "function",
+                 path("pyloc_testpkg", "mod.py"), 2, None),
+                ("pyloc_testpkg.sub.mod:f", "assign",
+                 path("pyloc_testpkg", "sub", "mod.py"), 2, 0),
+            ], index.search("f"))
+            self.assertEqual([], index.search("g"))
+            self.assertEqual([], index.search("os"))
+            # Changed files are parsed again.
+            with open(path("pyloc_testmod.py"), "w") as stream:
+                stream.write("\n\ndef f(): pass\n")
+            os.unlink(path("pyloc_testpkg", "mod.py"))
+            self.assertEqual(["pyloc_testmod:f", "pyloc_testpkg.sub.mod:f"],
+                             [d.target for d in index.search("f")])
+            self.assertEqual(3, index.search("f")[0].line)
+
+    def test_other_version(self):
+        import sqlite3
+        with self.index_fixture(self.SPEC) as (fctxt, index):
+            db = sqlite3.connect(index.path)
+            db.execute("PRAGMA user_version = 0")
+            db.commit()
+            db.close()
+            # Emptied until the next refresh.
+            index = Index(index.path)
+            self.assertIsNone(index.lookup("pyloc_testpkg.mod:C"))
+            self.assertEqual((2, 2, 0),
+                             tuple(index.refresh([fctxt.tmpdir])))
+            self.assertIsNotNone(index.lookup("pyloc_testpkg.mod:C"))
+
+    def test_complete(self):
+        with self.index_fixture(self.SPEC) as (fctxt, index):
+            self.assertEqual(["pyloc_testpkg"], index.complete("pyloc_t"))
+            self.assertEqual(["pyloc_testpkg.mod"],
+                             index.complete("pyloc_testpkg."))
+            self.assertEqual(["pyloc_testpkg.mod:C", "pyloc_testpkg.mod:g"],
+                             index.complete("pyloc_testpkg.mod:"))
+            self.assertEqual(["pyloc_testpkg.mod:C.PI", "pyloc_testpkg.mod:C.f"],
+                             index.complete("pyloc_testpkg.mod:C."))
+            self.assertEqual([], index.complete("pyloc_testpkg.mod:h"))
+            # The map is saved next to the index when it is built.
+            self.assertTrue(os.path.exists(index.path + ".map"))
+            modpath = os.path.join(fctxt.tmpdir, "pyloc_testpkg", "mod.py")
+            with open(modpath, "a") as stream:
+                stream.write("def h(): pass\n")
+            index.refresh([fctxt.tmpdir])
+            self.assertEqual(["pyloc_testpkg.mod:h"],
+                             Index(index.path).complete("pyloc_testpkg.mod:h"))
+            # Out-dated maps are not used.
+            with open(index.path + ".map", "rb") as stream:
+                names = stream.read()
+            with open(modpath, "a") as stream:
+                stream.write("def h2(): pass\n")
+            index.refresh([fctxt.tmpdir])
+            with open(index.path + ".map", "wb") as stream:
+                stream.write(names)
+            self.assertEqual(["pyloc_testpkg.mod:h", "pyloc_testpkg.mod:h2"],
+                             Index(index.path).complete("pyloc_testpkg.mod:h"))
+
+    def test_map(self):
+        with self.index_fixture(self.SPEC) as (fctxt, index):
+            modpath = os.path.join(fctxt.tmpdir, "pyloc_testpkg", "mod.py")
+            map_path = index.path + ".map"
+            with open(map_path, "rb") as stream:
+                data = stream.read()
+            # Maps in memory are read the same way.
+            key = _get_file_key(index.path)
+            index_map = _MappedIndex(data, key)
+            self.assertEqual([(1, 0, modpath)],
+                             [s[3:6] for s in index_map.find_target(
+                                 "pyloc_testpkg.mod", "C")])
+            self.assertEqual(2, len(index_map.find_target(
+                "pyloc_testpkg.mod", "g")))
+            self.assertEqual(["pyloc_testpkg.mod:C.f"],
+                             [":".join(s[:2])
+                              for s in index_map.find_name("f")])
+            self.assertEqual([], index_map.find_module("pyloc_testpkg.sub"))
+            with self.assertRaises(ValueError):
+                _MappedIndex(data, (None, 0, 0))
+            with self.assertRaises(ValueError):
+                _MappedIndex(data[:100], key)
+            # Broken maps are written again.
+            with open(map_path, "wb") as stream:
+                stream.write(data[:100])
+            self.assertEqual([(modpath, 1, 0)],
+                             Index(index.path).lookup("pyloc_testpkg.mod:C"))
+            self.assertEqual(len(data), os.path.getsize(map_path))
+
+    def test_parallel(self):
+        spec = dict(("pyloc_testmod%d" % i,
+                     "\n" * i + "class C%d(object): pass\n" % i)
+                    for i in range(40))
+        with self.fixture(spec) as fctxt:
+            index_path = os.path.join(fctxt.tmpdir, "index.sqlite")
+            stats = build_index(index_path, search_path=[fctxt.tmpdir],
+                                jobs=2)
+            self.assertEqual((40, 40, 0), tuple(stats))
+            index = Index(index_path)
+            for i in range(40):
+                modpath = os.path.join(fctxt.tmpdir, "pyloc_testmod%d.py" % i)
+                self.assertEqual([(modpath, i + 1, 0)],
+                                 index.lookup("pyloc_testmod%d:C%d" % (i, i)))
+
+class TestPylocBytecode(TestPylocStatic):
+    """Run all the tests again with the bytecode engine, on compiled
+    fixtures.
+
+    It must find the same locations as the static engine it falls back to.
+    """
+
+    ENGINE = "bytecode"
+
+    MODCONTENT = textwrap.dedent(
+        """\
+        import os
+        def deco(x):
+            return x
+        @deco
+        class C(object):
+            class D(object):
+                @staticmethod
+                def m():
+                    pass
+        """)
+
+    @contextlib.contextmanager
+    def fixture(self, spec):
+        import compileall
+        with super(TestPylocBytecode, self).fixture(spec) as fctxt:
+            compileall.compile_dir(fctxt.tmpdir, quiet=1)
+            yield fctxt
+
+    @unittest.skipIf(PY_VERSION < (3, 11, 0), "no class position before 3.11")
+    def test_no_parse(self):
+        with self.fixture({"pyloc_testmod":self.MODCONTENT}) as fctxt:
+            before = stats()
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="C", locs=(5, 0))
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="C.D", locs=(6, 4))
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="C.D.m", locs=7)
+            self.assertEqual(before["parses"], stats()["parses"])
+            self.assertNotIn("pyloc_testmod", sys.modules)
+
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_stale_pyc(self):
+        with self.fixture({"pyloc_testmod":self.MODCONTENT}) as fctxt:
+            gen_fixture_in({"pyloc_testmod":"\n" + self.MODCONTENT},
+                           fctxt.tmpdir)
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="C.D.m", locs=8)
+
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_rebound_name(self):
+        modcontent = self.MODCONTENT + "C = deco(C)\n"
+        with self.fixture({"pyloc_testmod":modcontent}) as fctxt:
+            before = stats()
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="C.D.m", locs=7)
+            # Left to the static engine.
+            self.assertEqual(before["parses"] + 1, stats()["parses"])
+
+    @unittest.skipIf(PY_VERSION < (3, 11, 0), "no class position before 3.11")
+    def test_sourceless(self):
+        import py_compile
+        with self.fixture({}) as fctxt:
+            source = os.path.join(fctxt.tmpdir, "pyloc_testmod.py")
+            with open(source, "w") as stream:
+                stream.write(self.MODCONTENT)
+            py_compile.compile(source, cfile=source + "c")
+            os.remove(source)
+            for engine in ("import", "bytecode"):
+                with save_sys_modules():
+                    self.assertEqual([(source + "c", 6, 4)],
+                                     pyloc("pyloc_testmod:C.D",
+                                           engine=engine))
+                with save_sys_modules():
+                    self.assertEqual([(source + "c", 2, None)],
+                                     pyloc("pyloc_testmod:deco",
+                                           engine=engine))
+
+class TestPylocPrefilter(TestPyloc):
+    """Run all the tests again parsing only the matching top-level blocks.
+    """
+
+    def setUp(self):
+        super(TestPylocPrefilter, self).setUp()
+        self.saved_min_size = pyloc_module._PREFILTER_MIN_SIZE
+        pyloc_module._PREFILTER_MIN_SIZE = 0
+
+    def tearDown(self):
+        pyloc_module._PREFILTER_MIN_SIZE = self.saved_min_size
+        super(TestPylocPrefilter, self).tearDown()
+
+    def test_class_in_string(self):
+        modcontent = textwrap.dedent(
+            '''\
+            DOC = """
+            class Foo(object):
+                pass
+            """
+            @decorator(
+            1)
+            @decorator
+            class Foo(object):
+                def m(self):
+                    pass
+            ''')
+        with self.fixture({"pyloc_testmod":modcontent}) as fctxt:
+            filename = os.path.join(fctxt.tmpdir, "pyloc_testmod.py")
+            # Before 3.8, classes start at their first decorator.
+            self.assertEqual(
+                [8 if PY_VERSION >= (3, 8, 0) else 5],
+                [n.lineno
+                 for n in pyloc_module._search_classdef(filename, "Foo",
+                                                          _LRUCache(1))])
+
+    @unittest.skipIf(PY_VERSION < (3, 0, 0), "no partial parsing on Python 2")
+    def test_large_module(self):
+        modcontent = "".join(
+            textwrap.dedent(
+                '''\
+                class C{i}(object):
+                    """Class number {i}."""
+                    X{i} = {i}
+                    if True:
+                        pass
+                    else:
+                        pass
+                '''.format(i=i))
+            for i in range(100))
+        modcontent = "# -*- coding: latin-1 -*-\n# \xe9\n" + modcontent
+        with self.fixture({}) as fctxt:
+            filename = os.path.join(fctxt.tmpdir, "pyloc_testmod.py")
+            with open(filename, "wb") as stream:
+                stream.write(modcontent.encode("latin-1"))
+            clear_cache()
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="C42", locs=(2 + 42 * 7 + 1, 0))
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="C99.X99",
+                                 locs=(2 + 99 * 7 + 3, 4))
+            # Nothing has been fully parsed.
+            self.assertEqual(0, cache_info().currsize)
+
+class TestZipImport(PylocTestCase):
+
+    MODCONTENT = textwrap.dedent(
+        """\
+        # -*- coding: latin-1 -*-
+        class C(object):
+            def m(self):
+                pass
+        X = 1
+        """)
+
+    @contextlib.contextmanager
+    def zip_fixture(self, modcontent):
+        import zipfile
+        with self.fixture({}) as fctxt:
+            archive = os.path.join(fctxt.tmpdir, "app.zip")
+            with zipfile.ZipFile(archive, "w") as zf:
+                zf.writestr("pyloc_testpkg/__init__.py", "")
+                zf.writestr("pyloc_testpkg/mod.py", modcontent)
+            sys.path.insert(0, archive)
+            try:
+                yield FixtureCtxt(self, archive)
+            finally:
+                sys.path.remove(archive)
+
+    def check_locations(self, engine):
+        with self.zip_fixture(self.MODCONTENT) as fctxt:
+            filename = os.path.join(fctxt.tmpdir, "pyloc_testpkg/mod.py")
+            for qualname, loc in (("C", (2, 0)), ("C.m", (3, None)),
+                                  ("X", (5, 0))):
+                with save_sys_modules():
+                    self.assertEqual(
+                        [(filename,) + loc],
+                        pyloc("pyloc_testpkg.mod:" + qualname,
+                              engine=engine))
+
+    def test_import(self):
+        self.check_locations("import")
+
+    def test_static(self):
+        self.check_locations("static")
+
+    def test_prefilter(self):
+        saved_min_size = pyloc_module._PREFILTER_MIN_SIZE
+        pyloc_module._PREFILTER_MIN_SIZE = 0
+        try:
+            self.check_locations("import")
+        finally:
+            pyloc_module._PREFILTER_MIN_SIZE = saved_min_size
+
+    def test_archive_opened_once(self):
+        with self.zip_fixture(self.MODCONTENT) as fctxt:
+            for i in range(3):
+                with save_sys_modules():
+                    pyloc("pyloc_testpkg.mod:C", engine="static")
+            zf, info = pyloc_module._get_archive_member(
+                os.path.join(fctxt.tmpdir, "pyloc_testpkg/mod.py"))
+            self.assertEqual("pyloc_testpkg/mod.py", info.filename)
+            self.assertIs(zf, pyloc_module._open_archive(fctxt.tmpdir))
+
+class TestComplete(PylocTestCase):
+
+    def test_trie(self):
+        trie = pyloc_module._NameTrie(sorted([
+            "a", "a.b", "a.b:C", "a.b:C.d", "a.b0", "a.b:D", "a.bc", "a:x",
+            "a:x.y", "b"]))
+        self.assertEqual(["a"], trie.complete("a"))
+        self.assertEqual(["a.b", "a.b0", "a.bc"], trie.complete("a."))
+        self.assertEqual(["a.b", "a.b0", "a.bc"], trie.complete("a.b"))
+        self.assertEqual(["a.b:C", "a.b:D"], trie.complete("a.b:"))
+        self.assertEqual(["a.b:C.d"], trie.complete("a.b:C."))
+        self.assertEqual(["a:x"], trie.complete("a:"))
+        self.assertEqual(["a", "b"], trie.complete(""))
+        self.assertEqual([], trie.complete("c"))
+
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_without_index(self):
+        spec = {
+            "pyloc_testpkg": {
+                "mod": "class C(object):\n    def f(self): pass\n",
+                "mod2": "",
+            },
+        }
+        with self.fixture(spec):
+            locator = Locator()
+            self.assertEqual(["pyloc_testpkg"], locator.complete("pyloc_testp"))
+            self.assertEqual(["pyloc_testpkg.mod", "pyloc_testpkg.mod2"],
+                             locator.complete("pyloc_testpkg.m"))
+            self.assertEqual(["pyloc_testpkg.mod:C"],
+                             locator.complete("pyloc_testpkg.mod:"))
+            self.assertEqual(["pyloc_testpkg.mod:C.f"],
+                             locator.complete("pyloc_testpkg.mod:C."))
+            self.assertEqual([], locator.complete("pyloc_testpkg.nope:"))
+            self.assertEqual([], locator.complete("pyloc_testpkg.mod.x"))
+            # Nothing is imported.
+            self.assertNotIn("pyloc_testpkg", sys.modules)
+            self.assertIn("sys", locator.complete("sy"))
+
+class TestTags(PylocTestCase):
+
+    SPEC = {
+        "pyloc_testpkg": {
+            "__init__": "import os\n"
+                        "from pyloc_testpkg.mod import C as D\n"
+                        "import os.path as osp\n",
+            "mod": textwrap.dedent(
+                """\
+                class C(object):
+                    class Nested(object):
+                        def f(self):
+                            pass
+                X = C
+                """),
+        },
+    }
+
+    @contextlib.contextmanager
+    def tags_fixture(self):
+        with self.fixture(self.SPEC) as fctxt:
+            yield (fctxt, os.path.join(fctxt.tmpdir, "tags"),
+                   os.path.join(fctxt.tmpdir, "cache.sqlite"))
+
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_ctags(self):
+        with self.tags_fixture() as (fctxt, output, cache):
+            stats = pyloc_module.build_tags("pyloc_testpkg", output,
+                                            cache=cache)
+            self.assertEqual((2, 2, 0), tuple(stats))
+            with open(output) as stream:
+                lines = [l for l in stream.read().splitlines()
+                         if not l.startswith("!_TAG_")]
+            mod = os.path.join("pyloc_testpkg", "mod.py")
+            init = os.path.join("pyloc_testpkg", "__init__.py")
+            self.assertEqual([
+                'C\t%s\t1;"\tc' % mod,
+                'D\t%s\t2;"\tx' % init,
+                'Nested\t%s\t2;"\tc\tclass:C' % mod,
+                'X\t%s\t5;"\tv' % mod,
+                'f\t%s\t3;"\tm\tclass:C.Nested' % mod,
+                'osp\t%s\t3;"\tx' % init,
+            ], lines)
+            # Only changed files are parsed again.
+            stats = pyloc_module.build_tags("pyloc_testpkg", output,
+                                            cache=cache)
+            self.assertEqual((2, 0, 0), tuple(stats))
+            with open(os.path.join(fctxt.tmpdir, "pyloc_testpkg", "mod.py"),
+                      "a") as stream:
+                stream.write("Y = 1\n")
+            stats = pyloc_module.build_tags("pyloc_testpkg", output,
+                                            cache=cache)
+            self.assertEqual((2, 1, 0), tuple(stats))
+            with open(output) as stream:
+                self.assertIn('Y\t%s\t6;"\tv\n' % mod, stream.read())
+
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_etags(self):
+        with self.tags_fixture() as (fctxt, output, cache):
+            pyloc_module.build_tags("pyloc_testpkg.mod", output,
+                                    format="etags", cache=cache)
+            with open(output, "rb") as stream:
+                data = stream.read()
+            header, _, section = data.partition(b"\n")[2].partition(b"\n")
+            self.assertEqual(os.path.join("pyloc_testpkg", "mod.py").encode()
+                             + b"," + str(len(section)).encode(), header)
+            self.assertEqual(b"\x0c", data[:1])
+            self.assertEqual(b"class C(object):\x7fC\x011,0\n"
+                             b"    class Nested(object):\x7fNested\x012,17\n"
+                             b"        def f(self):\x7ff\x013,43\n"
+                             b"X = C\x7fX\x015,81\n",
+                             section)
+
+    def test_json(self):
+        import json
+        with self.tags_fixture() as (fctxt, output, cache):
+            pyloc_module.build_tags(fctxt.tmpdir, output, format="json",
+                                    cache=cache)
+            with open(output) as stream:
+                tags = [json.loads(line) for line in stream]
+            self.assertEqual(6, len(tags))
+            self.assertEqual({"name": "f", "qualname": "C.Nested.f",
+                              "module": "pyloc_testpkg.mod",
+                              "path": os.path.join("pyloc_testpkg", "mod.py"),
+                              "line": 3, "column": None, "kind": "function"},
+                             tags[4])
+
+    def test_not_found(self):
+        with self.tags_fixture() as (fctxt, output, cache):
+            with self.assertRaises(pyloc_module.PylocError) as cm:
+                pyloc_module.build_tags("pyloc_doesnotexist", output,
+                                        cache=cache)
+            self.assertRegexp(str(cm.exception), "^cannot find package")
+
+class TestQualnameAt(PylocTestCase):
+
+    MODCONTENT = textwrap.dedent(
+        """\
+        import os
+
+        class C(object):
+            X = 1
+            @staticmethod
+            def f():
+                pass
+
+            class D(object):
+                def g(self):
+                    pass
+            Y = 2
+        if True:
+            def h():
+                def i():
+                    pass
+        else:
+            async def h():
+                pass
+        Z = 3
+        """)
+
+    @unittest.skipIf(PY_VERSION < (3, 5, 0), "async def added since 3.5")
+    def test_qualname_at(self):
+        with self.fixture({"pyloc_testmod":self.MODCONTENT}) as fctxt:
+            filename = os.path.join(fctxt.tmpdir, "pyloc_testmod.py")
+            expected = [None, None, None, "C", "C", "C.f", "C.f", "C.f",
+                        "C", "C.D", "C.D.g", "C.D.g", "C", None, "h", "h",
+                        "h", None, "h", "h", None, None]
+            locator = Locator()
+            self.assertEqual(expected,
+                             locator.qualnames_at(filename,
+                                                  range(len(expected))))
+            self.assertEqual("C.D.g", pyloc_module.qualname_at(filename, 10))
+            # Modified files are parsed again.
+            with open(filename, "w") as stream:
+                stream.write("\n" + self.MODCONTENT)
+            self.assertEqual("C.D", locator.qualname_at(filename, 10))
+
+    def test_module_name(self):
+        spec = {"pyloc_testpkg": {"mod": "", "sub": {}}}
+        with self.fixture(spec) as fctxt:
+            pkgdir = os.path.join(fctxt.tmpdir, "pyloc_testpkg")
+            get_module_name = pyloc_module._get_module_name
+            self.assertEqual("pyloc_testpkg.mod",
+                             get_module_name(os.path.join(pkgdir, "mod.py")))
+            self.assertEqual("pyloc_testpkg.sub",
+                             get_module_name(os.path.join(pkgdir, "sub",
+                                                          "__init__.py")))
+            self.assertIsNone(get_module_name("/not/in/sys/path.py"))
+
+class TestSymbolTable(unittest.TestCase):
+
+    @unittest.skipIf(PY_VERSION < (3, 5, 0), "async def added since 3.5")
+    def test_table(self):
+        import ast
+        source = textwrap.dedent(
+            """\
+            import os.path
+            from os import sep as SEP, getcwd
+            from os.path import *
+            class C(object):
+                X, Y = 1, 2
+                class D(object):
+                    def m(self):
+                        Z = 3
+                if X:
+                    async def m(self):
+                        pass
+            C.attr = 0
+            for i in range(3):
+                pass
+            [j for j in range(3)]
+            """)
+        table = _build_symbol_table(ast.parse(source))
+        kinds = dict((qualname, [(b.kind, b.lineno, b.nested)
+                                 for b in bindings])
+                     for qualname, bindings in table.items())
+        self.assertEqual({
+            "os": [("import", 1, False)],
+            "SEP": [("import", 2, False)],
+            "getcwd": [("import", 2, False)],
+            "*": [("star", 3, False)],
+            "C": [("class", 4, False)],
+            "C.X": [("assign", 5, False)],
+            "C.Y": [("assign", 5, False)],
+            "C.D": [("class", 6, False)],
+            "C.D.m": [("function", 7, False)],
+            "C.m": [("function", 10, True)],
+            "i": [("other", 13, True)],
+        }, kinds)
+        self.assertEqual(table["C.D"][0].parent, table["C"][0].row)
+        self.assertIsNone(table["C"][0].parent)
+        getcwd = table["getcwd"][0]
+        self.assertEqual(("getcwd", "os", 0, True, False),
+                         (getcwd.alias_name, getcwd.from_module, getcwd.level,
+                          getcwd.is_from_import, getcwd.has_asname))
+        self.assertTrue(table["SEP"][0].has_asname)
+        self.assertEqual((7, 8, 7), (table["C.D.m"][0].lineno,
+                                     table["C.D.m"][0].end_lineno,
+                                     table["C.D.m"][0].first_line))
+        self.assertNotIn("C.Z", table)
+
+class TestParseCache(PylocTestCase):
+
+    def setUp(self):
+        super(TestParseCache, self).setUp()
+        clear_cache()
+
+    def tearDown(self):
+        clear_cache()
+        super(TestParseCache, self).tearDown()
+
+    def test_lru_eviction(self):
+        cache = _LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual((3, 1, 2, 2), tuple(cache.info()))
+
+    def test_parse_once_for_class_alias(self):
+        modcontent = textwrap.dedent(
+            """\
+            from collections import namedtuple
+            Point = namedtuple("Point", "x y")
+            """)
+        with self.fixture({"pyloc_testmod":modcontent}) as fctxt:
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="Point",
+                                 locs=(2, 0))
+        info = cache_info()
+        self.assertEqual(1, info.misses)
+        self.assertEqual(1, info.hits)
+        self.assertEqual(1, info.currsize)
+
+    def test_modified_file_is_parsed_again(self):
+        with self.fixture({"pyloc_testmod":"class Foo(object): pass"}) \
+             as fctxt:
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="Foo",
+                                 locs=(1, 0))
+            gen_fixture_in({"pyloc_testmod":"\nclass Foo(object): pass"},
+                           fctxt.tmpdir)
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod",
+                                 qualname="Foo",
+                                 locs=(2, 0))
+        self.assertEqual(2, cache_info().misses)
+
+class TestLocator(PylocTestCase):
+
+    MODCONTENT = textwrap.dedent(
+        """\
+        class C(object):
+            X = 1
+        def f():
+            pass
+        """)
+
+    def test_locate_many(self):
+        locator = Locator()
+        with self.fixture({"pyloc_testmod":self.MODCONTENT}) as fctxt:
+            filename = os.path.join(fctxt.tmpdir, "pyloc_testmod.py")
+            self.assertEqual(
+                [[(filename, 1, 0)], [(filename, 2, 4)], [(filename, 3, None)]],
+                locator.locate_many(["pyloc_testmod:C", "pyloc_testmod.C.X",
+                                     "pyloc_testmod:f"]))
+        self.assertEqual(1, locator.cache_info().misses)
+
+    def test_threads(self):
+        import threading
+        locator = Locator()
+        targets = ["pyloc_testmod:C", "pyloc_testmod:C.X", "pyloc_testmod:f"]
+        results = []
+        def work():
+            results.append(locator.locate_many(targets))
+        with self.fixture({"pyloc_testmod":self.MODCONTENT}):
+            expected = locator.locate_many(targets)
+            threads = [threading.Thread(target=work) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual([expected] * 8, results)
+
+    def test_reimported_module(self):
+        locator = Locator()
+        with self.fixture({"pyloc_testmod":self.MODCONTENT}) as fctxt:
+            filename = os.path.join(fctxt.tmpdir, "pyloc_testmod.py")
+            with save_sys_modules():
+                self.assertEqual([(filename, 3, None)],
+                                 locator.locate("pyloc_testmod:f"))
+            gen_fixture_in({"pyloc_testmod":"\n" + self.MODCONTENT},
+                           fctxt.tmpdir)
+            with save_sys_modules():
+                self.assertEqual([(filename, 4, None)],
+                                 locator.locate("pyloc_testmod:f"))
+
+    def test_locate_object(self):
+        locator = Locator()
+        with self.fixture({"pyloc_testmod":self.MODCONTENT}) as fctxt:
+            filename = os.path.join(fctxt.tmpdir, "pyloc_testmod.py")
+            import pyloc_testmod
+            self.assertEqual(
+                [[(filename, None, None)], [(filename, 1, 0)],
+                 [(filename, 3, None)], [(filename, 3, None)]],
+                locator.locate_objects([pyloc_testmod, pyloc_testmod.C,
+                                        pyloc_testmod.f,
+                                        pyloc_testmod.f.__code__]))
+            info = locator._objects.info()
+            self.assertEqual((1, 3), (info.hits, info.misses))
+        with self.assertRaises(TypeError):
+            locator.locate_object(1)
+
+    def test_timings(self):
+        timings = {}
+        with self.fixture({"pyloc_testmod":self.MODCONTENT}):
+            Locator().locate("pyloc_testmod:C", timings=timings)
+        for phase in ("import", "getsourcefile", "read", "parse", "visit",
+                      "total"):
+            self.assertIn(phase, timings)
+        self.assertTrue(set(timings) <= set(pyloc_module.PHASES))
+        self.assertTrue(all(v >= 0 for v in timings.values()))
+        self.assertLessEqual(timings["parse"], timings["total"])
+
+    def test_bounded_caches(self):
+        locator = Locator(cache_size=1)
+        with self.fixture({"pyloc_testmod":self.MODCONTENT}):
+            locator.locate_many(["pyloc_testmod:C", "pyloc_testmod:f"])
+        self.assertEqual(1, locator._modules.info().currsize)
+        self.assertEqual(1, locator._attrs.info().currsize)
+
+class TestHooks(PylocTestCase):
+
+    def setUp(self):
+        super(TestHooks, self).setUp()
+        self.events = []
+        add_hook(self.hook)
+
+    def tearDown(self):
+        remove_hook(self.hook)
+        super(TestHooks, self).tearDown()
+
+    def hook(self, event, name, duration):
+        self.events.append((event, name, duration))
+
+    def test_events(self):
+        modcontent = textwrap.dedent(
+            """\
+            class C(object):
+                def m(self):
+                    pass
+            class C(object):
+                pass
+            """)
+        before = stats()
+        locator = Locator()
+        with self.fixture({"pyloc_testmod":modcontent}) as fctxt:
+            filename = os.path.join(fctxt.tmpdir, "pyloc_testmod.py")
+            locator.locate("pyloc_testmod:C")
+            locator.locate("pyloc_testmod:C")
+        self.assertEqual(
+            [("import_start", "pyloc_testmod"),
+             ("import_end", "pyloc_testmod"),
+             ("cache_miss", filename),
+             ("read", filename),
+             ("parse", filename),
+             ("disamb", filename),
+             ("cache_hit", filename),
+             ("disamb", filename)],
+            [e[:2] for e in self.events])
+        self.assertEqual(0, self.events[0][2])
+        after = stats()
+        self.assertEqual(1, after["imports"] - before["imports"])
+        self.assertEqual(1, after["parses"] - before["parses"])
+        self.assertEqual(1, after["cache_hits"] - before["cache_hits"])
+        self.assertEqual(1, after["cache_misses"] - before["cache_misses"])
+        self.assertEqual(sum(e[2] for e in self.events if e[0] == "parse"),
+                         after["parse_ns"] - before["parse_ns"])
+
+    def test_remove_hook(self):
+        remove_hook(self.hook)
+        with self.fixture({"pyloc_testmod":""}) as fctxt:
+            fctxt.assertLocEqual("pyloc_testmod.py", "pyloc_testmod")
+        add_hook(self.hook)
+        self.assertEqual([], self.events)
+
 class TestCLI(unittest.TestCase):
     """Base class of command line interface test case.
 
@@ -883,12 +1903,17 @@ class TestCLI(unittest.TestCase):
         if pythonpath is not None:
             env.setdefault("PYTHONPATH", "")
             env["PYTHONPATH"] += ":"+":".join(pythonpath)
+        stdin = kwargs.get("stdin")
         self.pyloc = sp.Popen(cmd,
                               executable=exe,
+                              stdin=None if stdin is None else sp.PIPE,
                               stdout=sp.PIPE,
                               stderr=sp.PIPE,
                               universal_newlines=True,
                               env=env)
+        if stdin is not None:
+            self.pyloc.stdin.write(stdin)
+            self.pyloc.stdin.close()
         self.pyloc.wait()
         return self.pyloc.returncode
 
@@ -974,6 +1999,85 @@ class CLITestMethods(CompatAssert):
         self.assertEqual(pyloc_rc, 1)
         self.assertMultiLineEqual("", self.pyloc.stdout.read())
 
+    def test_many_targets(self):
+        spec = {"pyloc_testmod":"class C(object): pass\n"}
+        self.gen_fixture(spec)
+        pyloc_rc = self.run_pyloc('--format', self.FORMAT,
+                                  'pyloc_testmod', 'doesnotexist',
+                                  'pyloc_testmod:C',
+                                  pythonpath=[self.tmpdir])
+        self.assertRegexp(self.pyloc.stderr.read(),
+                         r"^pyloc: failed to import 'doesnotexist' ")
+        self.assertEqual(pyloc_rc, 1)
+        modpathname = os.path.join(self.tmpdir, "pyloc_testmod.py")
+        self.assertOutput(self.pyloc.stdout.read(),
+                          [(modpathname, None, None),
+                           (modpathname, 1, None)])
+
+    def test_many_targets_with_builtin_module(self):
+        spec = {"pyloc_testmod":"class C(object): pass\n"}
+        self.gen_fixture(spec)
+        pyloc_rc = self.run_pyloc('--format', self.FORMAT,
+                                  'pyloc_testmod', 'sys', 'pyloc_testmod:C',
+                                  pythonpath=[self.tmpdir])
+        # Errors other than PylocError do not stop the others either.
+        self.assertRegexp(self.pyloc.stderr.read(),
+                         r"^pyloc: TypeError: .* is a built-in module")
+        self.assertEqual(pyloc_rc, 1)
+        modpathname = os.path.join(self.tmpdir, "pyloc_testmod.py")
+        self.assertOutput(self.pyloc.stdout.read(),
+                          [(modpathname, None, None),
+                           (modpathname, 1, None)])
+
+    def test_stdin(self):
+        spec = {"pyloc_testmod":"\nclass C(object): pass\n"}
+        self.gen_fixture(spec)
+        pyloc_rc = self.run_pyloc('--format', self.FORMAT, '--stdin',
+                                  pythonpath=[self.tmpdir],
+                                  stdin="pyloc_testmod:C\n\npyloc_testmod\n")
+        self.assertMultiLineEqual("", self.pyloc.stderr.read())
+        self.assertEqual(pyloc_rc, 0)
+        modpathname = os.path.join(self.tmpdir, "pyloc_testmod.py")
+        self.assertOutput(self.pyloc.stdout.read(),
+                          [(modpathname, 2, None),
+                           (modpathname, None, None)])
+
+    def test_timings(self):
+        spec = {"pyloc_testmod":"class C(object): pass\n"}
+        self.gen_fixture(spec)
+        pyloc_rc = self.run_pyloc('--format', self.FORMAT, '--timings',
+                                  'pyloc_testmod:C', 'pyloc_testmod',
+                                  pythonpath=[self.tmpdir])
+        self.assertEqual(pyloc_rc, 0)
+        stderr = self.pyloc.stderr.read()
+        self.assertRegexp(stderr,
+                          r"(?m)^pyloc: timings: pyloc_testmod:C: total "
+                          r"[0-9.]+ms \(.*import [0-9.]+ms.*parse [0-9.]+ms")
+        self.assertRegexp(stderr, r"(?m)^phase +total +p50 +p90 +p99 +max$")
+        self.assertRegexp(stderr, r"(?m)^2 objects$")
+
+    def test_non_ascii_source_in_c_locale(self):
+        modpathname = os.path.join(self.tmpdir, "pyloc_testmod.py")
+        with open(modpathname, "wb") as stream:
+            stream.write(u"# -*- coding: utf-8 -*-\n"
+                         u"\"\"\"\u00e9t\u00e9\"\"\"\n"
+                         u"class C(object): pass\n".encode("utf-8"))
+        env = os.environ.copy()
+        env.update(LC_ALL="C", PYTHONUTF8="0", PYTHONCOERCECLOCALE="0")
+        pyloc_rc = self.run_pyloc('--format', self.FORMAT,
+                                  'pyloc_testmod:C',
+                                  pythonpath=[self.tmpdir], env=env)
+        self.assertMultiLineEqual("", self.pyloc.stderr.read())
+        self.assertEqual(pyloc_rc, 0)
+        self.assertOutput(self.pyloc.stdout.read(),
+                          [(modpathname, 3, None)])
+
+    def test_no_target(self):
+        pyloc_rc = self.run_pyloc('--format', self.FORMAT)
+        self.assertRegexp(self.pyloc.stderr.read(),
+                          r"at least one object name is required")
+        self.assertEqual(pyloc_rc, 2)
+
 class TestCLIHuman(TestCLI, CLITestMethods):
 
     FORMAT = 'human'
@@ -1049,6 +2153,383 @@ class TestCLIVi(TestCLIEmacs):
 
     FORMAT = 'vi'
 
+class TestCLIJSON(TestCLI, CompatAssert):
+
+    MODCONTENT = textwrap.dedent(
+        """\
+        class C(object):
+            pass
+        if True:
+            class D(object):
+                pass
+        else:
+            class D(object):
+                pass
+        """)
+
+    def setUp(self):
+        super(TestCLIJSON, self).setUp()
+        # Paths with spaces must not be a problem.
+        self.moddir = os.path.join(self.tmpdir, "with space")
+        os.mkdir(self.moddir)
+        gen_fixture_in({"pyloc_testmod":self.MODCONTENT}, self.moddir)
+        self.modpathname = os.path.join(self.moddir, "pyloc_testmod.py")
+
+    def expected_records(self):
+        def loc(line, column):
+            return {"filename": self.modpathname, "line": line,
+                    "column": column}
+        return [
+            dict(target="pyloc_testmod:C", error=None,
+                 candidates=[loc(1, 0)], **loc(1, 0)),
+            dict(target="doesnotexist", filename=None, line=None,
+                 column=None, candidates=[],
+                 error="failed to import 'doesnotexist' "
+                 "(ModuleNotFoundError: No module named 'doesnotexist')"),
+            # Since 3.13, classes know the line they start at.
+            dict(target="pyloc_testmod:D", error=None,
+                 candidates=[loc(4, 4)] if PY_VERSION >= (3, 13, 0)
+                 else [loc(4, 4), loc(7, 4)], **loc(4, 4)),
+        ]
+
+    @unittest.skipIf(PY_VERSION < (3, 6, 0), "ModuleNotFoundError since 3.6")
+    def test_json(self):
+        import json
+        pyloc_rc = self.run_pyloc('--format', 'json', 'pyloc_testmod:C',
+                                  'doesnotexist', 'pyloc_testmod:D',
+                                  pythonpath=[self.moddir])
+        self.assertEqual(pyloc_rc, 1)
+        self.assertMultiLineEqual("", self.pyloc.stderr.read())
+        self.assertEqual(self.expected_records(),
+                         json.loads(self.pyloc.stdout.read()))
+
+    def test_json_no_target(self):
+        import json
+        pyloc_rc = self.run_pyloc('--format', 'json', '--stdin', stdin="")
+        self.assertEqual(pyloc_rc, 0)
+        self.assertEqual([], json.loads(self.pyloc.stdout.read()))
+
+    @unittest.skipIf(PY_VERSION < (3, 6, 0), "ModuleNotFoundError since 3.6")
+    def test_ndjson(self):
+        import json
+        pyloc_rc = self.run_pyloc('--format', 'ndjson', 'pyloc_testmod:C',
+                                  'doesnotexist', 'pyloc_testmod:D',
+                                  pythonpath=[self.moddir])
+        self.assertEqual(pyloc_rc, 1)
+        self.assertEqual(self.expected_records(),
+                         [json.loads(line)
+                          for line in self.pyloc.stdout.read().splitlines()])
+
+    def test_ndjson_streamed(self):
+        import json
+        import subprocess as sp
+        env = os.environ.copy()
+        env["PYTHONPATH"] = self.moddir
+        self.pyloc = sp.Popen([sys.executable, "-m", "pyloc", "-f", "ndjson",
+                               "--stdin"],
+                              stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE,
+                              universal_newlines=True, env=env)
+        for target, line in (("pyloc_testmod:C", 1), ("pyloc_testmod", None)):
+            self.pyloc.stdin.write(target + "\n")
+            self.pyloc.stdin.flush()
+            # The record comes before the end of the input.
+            record = json.loads(self.pyloc.stdout.readline())
+            self.assertEqual((target, line), (record["target"],
+                                              record["line"]))
+        self.pyloc.stdin.close()
+        self.assertEqual(0, self.pyloc.wait())
+
+class TestCLINames(TestCLI, CompatAssert):
+
+    @unittest.skipIf(PY_VERSION < (3, 4, 0), "find_spec added since 3.4")
+    def test_complete(self):
+        self.gen_fixture({"pyloc_testmod":"class C(object): pass\n"
+                          "class D(object): pass\n"})
+        pyloc_rc = self.run_pyloc("--no-index", "--complete", "pyloc_testmod:",
+                                  pythonpath=[self.tmpdir])
+        self.assertEqual(0, pyloc_rc)
+        self.assertEqual("pyloc_testmod:C\npyloc_testmod:D\n",
+                         self.pyloc.stdout.read())
+
+    def test_search(self):
+        self.gen_fixture({"pyloc_testmod":"class C(object): pass\n"})
+        index_path = os.path.join(self.tmpdir, "index.sqlite")
+        # Indexing parses in-process: tests checking that a module is not
+        # imported yet must not see the modules imported for it (e.g. mmap).
+        with save_sys_modules():
+            build_index(index_path, search_path=[self.tmpdir])
+        pyloc_rc = self.run_pyloc("--index", index_path, "-f", "human",
+                                  "--search", "C")
+        self.assertEqual(0, pyloc_rc)
+        self.assertEqual("Target: pyloc_testmod:C\nFilename: {}\nLine: 1\n"
+                         .format(os.path.join(self.tmpdir, "pyloc_testmod.py")),
+                         self.pyloc.stdout.read())
+        pyloc_rc = self.run_pyloc("--index", index_path, "--search", "D")
+        self.assertEqual(1, pyloc_rc)
+        self.assertEqual("", self.pyloc.stdout.read())
+        pyloc_rc = self.run_pyloc("--no-index", "--search", "C")
+        self.assertEqual(1, pyloc_rc)
+        self.assertRegexp(self.pyloc.stderr.read(),
+                          r"^pyloc: cannot search 'C' without an index")
+
+    def test_at(self):
+        self.gen_fixture({"pyloc_testmod":"class C(object):\n"
+                          "    def f(self):\n        pass\n"})
+        modpathname = os.path.join(self.tmpdir, "pyloc_testmod.py")
+        pyloc_rc = self.run_pyloc("--at", "--stdin",
+                                  stdin="{0}:3\n{0}:4\nnoline\n{0}:1\n"
+                                  .format(modpathname),
+                                  pythonpath=[self.tmpdir])
+        self.assertEqual(1, pyloc_rc)
+        self.assertEqual("pyloc_testmod:C.f\npyloc_testmod\npyloc_testmod:C\n",
+                         self.pyloc.stdout.read())
+        self.assertRegexp(self.pyloc.stderr.read(),
+                          r"^pyloc: invalid position \(expected FILE:LINE\)")
+        missing = os.path.join(self.tmpdir, "missing.py")
+        pyloc_rc = self.run_pyloc("--at", missing + ":3")
+        self.assertEqual(1, pyloc_rc)
+        self.assertRegexp(self.pyloc.stderr.read(),
+                          r"^pyloc: cannot read '.*missing\.py'")
+
+    def test_completion_script(self):
+        for shell in ("bash", "zsh"):
+            pyloc_rc = self.run_pyloc("--completion-script", shell)
+            self.assertEqual(0, pyloc_rc)
+            self.assertIn("--complete", self.pyloc.stdout.read())
+
+class TestServer(TestCLI, CompatAssert):
+
+    def setUp(self):
+        super(TestServer, self).setUp()
+        self.server = None
+        self.socket = os.path.join(self.tmpdir, "pyloc.sock")
+
+    def tearDown(self):
+        if self.server is not None:
+            if self.server.poll() is None:
+                self.server.terminate()
+            self.server.wait()
+            close_if_not_none(self.server.stderr)
+        super(TestServer, self).tearDown()
+
+    def start_server(self, *args):
+        import subprocess as sp
+        import time
+        exe = sys.executable
+        cmd = [exe, '-m', 'pyloc', '--serve', '--socket', self.socket]
+        cmd.extend(args)
+        env = os.environ.copy()
+        env["PYTHONPATH"] = env.get("PYTHONPATH", "") + ":" + self.tmpdir
+        self.server = sp.Popen(cmd, executable=exe, stderr=sp.PIPE,
+                               universal_newlines=True, env=env)
+        for _ in range(100):
+            if os.path.exists(self.socket):
+                return
+            time.sleep(0.05)
+        self.fail("server did not start")
+
+    def test_client(self):
+        self.gen_fixture({"pyloc_testmod":"\nclass C(object): pass\n"})
+        self.start_server()
+        modpathname = os.path.join(self.tmpdir, "pyloc_testmod.py")
+        for _ in range(2):
+            pyloc_rc = self.run_pyloc('--format', 'emacs', '--client',
+                                      '--socket', self.socket,
+                                      'pyloc_testmod:C', 'doesnotexist')
+            self.assertRegexp(self.pyloc.stderr.read(),
+                              r"^pyloc: failed to import 'doesnotexist' ")
+            self.assertEqual(1, pyloc_rc)
+            self.assertEqual("+2 %s\n" % (modpathname,),
+                             self.pyloc.stdout.read())
+
+    def test_idle_timeout(self):
+        self.start_server('--idle-timeout', '0.2')
+        self.assertEqual(0, self.server.wait())
+        self.assertFalse(os.path.exists(self.socket))
+
+    def test_not_a_socket(self):
+        with open(self.socket, "w") as f:
+            f.write("notes\n")
+        pyloc_rc = self.run_pyloc('--serve', '--socket', self.socket)
+        self.assertRegexp(self.pyloc.stderr.read(),
+                          r"^pyloc: '.*' exists and is not a socket")
+        self.assertEqual(1, pyloc_rc)
+        with open(self.socket) as f:
+            self.assertEqual("notes\n", f.read())
+
+    def test_no_server(self):
+        pyloc_rc = self.run_pyloc('--client', '--socket', self.socket,
+                                  'subprocess')
+        self.assertRegexp(self.pyloc.stderr.read(),
+                          r"^pyloc: cannot connect to server")
+        self.assertEqual(1, pyloc_rc)
+
+def frame_message(message):
+    import json
+    body = json.dumps(message).encode("utf-8")
+    return "Content-Length: {}\r\n\r\n".format(len(body)).encode("ascii") \
+        + body
+
+def read_messages(data):
+    import json
+    messages = []
+    while data:
+        header, _, data = data.partition(b"\r\n\r\n")
+        length = int(header.split(b":")[1])
+        messages.append(json.loads(data[:length].decode("utf-8")))
+        data = data[length:]
+    return messages
+
+def rpc_request(msgid, method, **params):
+    return frame_message({"jsonrpc": "2.0", "id": msgid, "method": method,
+                          "params": params})
+
+class TestStdioServer(TestCLI, CompatAssert):
+
+    def setUp(self):
+        super(TestStdioServer, self).setUp()
+        self.gen_fixture({"pyloc_testmod":"\nclass C(object): pass\n"})
+        self.modpathname = os.path.join(self.tmpdir, "pyloc_testmod.py")
+        sys.path.insert(0, self.tmpdir)
+        # The server runs in-process: forget the modules it imports, the
+        # fixture and those imported to parse it (e.g. mmap).
+        self.saved_modules = save_sys_modules()
+        self.saved_modules.__enter__()
+
+    def tearDown(self):
+        self.saved_modules.__exit__(None, None, None)
+        sys.path.remove(self.tmpdir)
+        super(TestStdioServer, self).tearDown()
+
+    def serve(self, server, *messages):
+        import io
+        server.rfile = io.BytesIO(b"".join(messages))
+        server.wfile = io.BytesIO()
+        server.serve()
+        return dict((response["id"], response)
+                    for response in read_messages(server.wfile.getvalue()))
+
+    def test_methods(self):
+        server = pyloc_module._StdioServer(None, None, engine="static")
+        responses = self.serve(
+            server,
+            rpc_request(1, "locate", target="pyloc_testmod:C"),
+            rpc_request(2, "locateMany",
+                        targets=["pyloc_testmod", "pyloc_testmod:D"]),
+            rpc_request(3, "locate"),
+            rpc_request(4, "foo"),
+            rpc_request(7, "complete", prefix="pyloc_testm"),
+            b"Content-Length: 3\r\n\r\n{]}",
+            rpc_request(5, "shutdown"),
+            rpc_request(6, "locate", target="pyloc_testmod:C"))
+        self.assertEqual(2, responses[1]["result"]["line"])
+        self.assertEqual(self.modpathname,
+                         responses[1]["result"]["filename"])
+        records = responses[2]["result"]
+        self.assertEqual(["pyloc_testmod", "pyloc_testmod:D"],
+                         [record["target"] for record in records])
+        self.assertIsNone(records[0]["error"])
+        self.assertIn("cannot get attribute 'D'", records[1]["error"])
+        self.assertEqual(-32602, responses[3]["error"]["code"])
+        self.assertEqual(-32601, responses[4]["error"]["code"])
+        self.assertEqual(["pyloc_testmod"], responses[7]["result"])
+        self.assertEqual(-32700, responses[None]["error"]["code"])
+        self.assertIsNone(responses[5]["result"])
+        # Nothing is read after shutdown.
+        self.assertNotIn(6, responses)
+
+    def test_invalidate(self):
+        self.gen_fixture({"pyloc_testmod":"def f():\n    pass\n"})
+        server = pyloc_module._StdioServer(None, None, engine="import")
+        locate_f = rpc_request(1, "locate", target="pyloc_testmod:f")
+        responses = self.serve(server, locate_f)
+        self.assertEqual(1, responses[1]["result"]["line"])
+        self.gen_fixture({"pyloc_testmod":"\n\ndef f():\n    pass\n"})
+        # Still the module imported before.
+        responses = self.serve(server, locate_f)
+        self.assertEqual(1, responses[1]["result"]["line"])
+        responses = self.serve(
+            server,
+            rpc_request(0, "invalidate", file=self.modpathname),
+            locate_f)
+        self.assertIsNone(responses[0]["result"])
+        self.assertEqual(3, responses[1]["result"]["line"])
+
+    def test_invalid_id(self):
+        import io
+        server = pyloc_module._StdioServer(None, None, engine="static")
+        server.rfile = io.BytesIO(b"".join([
+            rpc_request([1], "locate", target="pyloc_testmod:C"),
+            rpc_request({"a": 1}, "locate", target="pyloc_testmod:C"),
+            frame_message({"jsonrpc": "2.0", "method": "$/cancelRequest",
+                           "params": {"id": [2]}}),
+            rpc_request(2, "locate", target="pyloc_testmod:C")]))
+        server.wfile = io.BytesIO()
+        server.serve()
+        responses = read_messages(server.wfile.getvalue())
+        self.assertEqual([(None, -32600)] * 2,
+                         [(response["id"], response["error"]["code"])
+                          for response in responses[:2]])
+        self.assertEqual(2, responses[2]["id"])
+        self.assertEqual(2, responses[2]["result"]["line"])
+
+    def test_cancel(self):
+        import threading
+
+        class BlockingServer(pyloc_module._StdioServer):
+            """Block the first target until request 1 is cancelled."""
+
+            unblock = threading.Event()
+
+            def _cancel(self, params):
+                super(BlockingServer, self)._cancel(params)
+                if params["id"] == 1:
+                    self.unblock.set()
+
+            def _do_locate(self, msgid, target):
+                if target == "block":
+                    self.unblock.wait(10)
+                return super(BlockingServer, self)._do_locate(msgid, target)
+
+        def cancel(msgid):
+            return frame_message({"jsonrpc": "2.0",
+                                  "method": "$/cancelRequest",
+                                  "params": {"id": msgid}})
+        server = BlockingServer(None, None, workers=1)
+        responses = self.serve(
+            server,
+            rpc_request(1, "locateMany", targets=["block", "pyloc_testmod"]),
+            rpc_request(2, "locate", target="pyloc_testmod"),
+            rpc_request(3, "locate", target="pyloc_testmod"),
+            cancel(2),
+            cancel(1),
+            # Already answered or unknown.
+            cancel(42))
+        self.assertEqual(-32800, responses[1]["error"]["code"])
+        self.assertEqual(-32800, responses[2]["error"]["code"])
+        self.assertEqual(self.modpathname,
+                         responses[3]["result"]["filename"])
+
+    def test_stdio(self):
+        import subprocess as sp
+        self.gen_fixture({"pyloc_testmod":"print('hello')\n"
+                          "class C(object): pass\n"})
+        env = os.environ.copy()
+        env["PYTHONPATH"] = self.tmpdir
+        self.pyloc = sp.Popen([sys.executable, "-m", "pyloc", "--stdio"],
+                              stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE,
+                              env=env)
+        out, err = self.pyloc.communicate(
+            rpc_request(1, "locate", target="pyloc_testmod:C")
+            + rpc_request(2, "shutdown"))
+        self.assertEqual(0, self.pyloc.returncode)
+        # What the module prints does not corrupt the responses.
+        self.assertEqual(b"hello\n", err)
+        responses = read_messages(out)
+        self.assertEqual([1, 2], [response["id"] for response in responses])
+        self.assertEqual(2, responses[0]["result"]["line"])
+        self.assertIsNone(responses[1]["result"])
+
 class TestVersion(unittest.TestCase):
 
     def setUp(self):